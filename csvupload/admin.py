@@ -1,4 +1,6 @@
 from django.contrib import admin
-from .models import CSVData
+from .models import CSVData, UploadJob, LoadedTable
 
-admin.site.register(CSVData)
\ No newline at end of file
+admin.site.register(CSVData)
+admin.site.register(UploadJob)
+admin.site.register(LoadedTable)
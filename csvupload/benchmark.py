@@ -0,0 +1,212 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from .ingest import CHUNK_ROWS, KNOWN_DATE_FORMATS, SAMPLE_ROWS, infer_schema, iter_typed_chunks
+from .loaders import clean_data_for_mysql
+from .parsers import PARSER_ENGINE, open_chunk_reader
+from .pipeline import ingest_csv
+from .planner import TableStats
+from .sinks import get_sink
+
+# Real uploads benchmarked next to the synthetic files: the samples shipped in uploads/,
+# named one by one because user uploads are stored there too, under their SHA-256
+SAMPLES_PATH = os.path.join(settings.BASE_DIR, 'uploads')
+
+SAMPLE_FILES = ['mysql - Sheet1.csv', 'mysql - Sheet1_ceJxEkl.csv', 'salses.csv', 'superStore5 (1).csv']
+
+# Relative weights of the column kinds in a synthetic file
+DEFAULT_MIX = {'integer': 2, 'float': 2, 'boolean': 1, 'date': 3, 'mixed': 1, 'text': 2, 'long': 1}
+
+COLUMN_KINDS = set(DEFAULT_MIX)
+
+GENERATE_BLOCK_ROWS = 100000
+
+# Parse 'date=3,text=1' into {'date': 3, 'text': 1}
+def parse_mix(text):
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        kind, _, weight = part.partition('=')
+        if kind not in COLUMN_KINDS:
+            raise ValueError(f"Column kind must be one of {', '.join(sorted(COLUMN_KINDS))}")
+        mix[kind] = int(weight or 1)
+    return mix
+
+# Column kinds for `columns` columns, spread by weight and interleaved
+def column_kinds(columns, mix=None):
+    mix = {kind: weight for kind, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+    total = sum(mix.values())
+    counts = {kind: columns * weight // total for kind, weight in mix.items()}
+    for kind in sorted(mix, key=mix.get, reverse=True)[:columns - sum(counts.values())]:
+        counts[kind] += 1
+    kinds = []
+    while len(kinds) < columns:
+        for kind in mix:
+            if counts[kind]:
+                kinds.append(kind)
+                counts[kind] -= 1
+    return kinds
+
+def _column(kind, index, start, rows, rng):
+    if kind == 'integer':
+        return rng.integers(-10 ** (index % 9 + 1), 10 ** (index % 9 + 1), rows)
+    elif kind == 'float':
+        return rng.normal(0, 1000, rows).round(index % 6 + 1)
+    elif kind == 'boolean':
+        return rng.random(rows) < 0.5
+    elif kind == 'date':
+        # Each date column uses the next supported format in turn
+        fmt = KNOWN_DATE_FORMATS[index % len(KNOWN_DATE_FORMATS)]
+        days = pd.to_timedelta(rng.integers(0, 365 * 30, rows), unit='D')
+        return (pd.Timestamp('1995-01-01') + days).strftime(fmt)
+    elif kind == 'mixed':
+        # Mostly numbers, with text mixed in throughout
+        values = rng.integers(0, 100000, rows).astype(object)
+        text = rng.random(rows) < 0.05
+        values[text] = [f'n/{value}' for value in values[text]]
+        return values
+    elif kind == 'text':
+        return np.array([f'value {i}' for i in range(20)])[rng.integers(0, 20, rows)]
+    lengths = rng.integers(100, 2000, rows)
+    return [f'row {start + i} ' + 'x' * length for i, length in enumerate(lengths)]
+
+# Write a synthetic CSV of `rows` rows and `columns` columns of the kinds in `mix`, with
+# about `null_ratio` of the cells left empty. Integer columns are kept whole, since a gap
+# would make them floats. The same arguments give the same bytes.
+def generate_csv(path, rows, columns, mix=None, null_ratio=0.02, seed=0):
+    kinds = column_kinds(columns, mix)
+    names = [f'{kind}_{index}' for index, kind in enumerate(kinds)]
+    rng = np.random.default_rng(seed)
+    for start in range(0, max(rows, 1), GENERATE_BLOCK_ROWS):
+        count = min(GENERATE_BLOCK_ROWS, rows - start)
+        block = pd.DataFrame({
+            name: _column(kind, index, start, count, rng) for index, (name, kind) in enumerate(zip(names, kinds))
+        })
+        if null_ratio:
+            gaps = rng.random(block.shape) < null_ratio
+            gaps[:, [kind == 'integer' for kind in kinds]] = False
+            block = block.astype(object).mask(gaps)
+        block.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    return kinds
+
+# Time parsing, inference, typing and type planning of one file on their own, outside any load
+def profile_stages(path, sink, parser_engine=None):
+    stages = {}
+    started = time.perf_counter()
+    reader = open_chunk_reader(path, parser_engine)
+    try:
+        sample = reader.read_sample(SAMPLE_ROWS)
+        stages['sample'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        schema = infer_schema(sample)
+        stages['infer'] = time.perf_counter() - started
+
+        # Parsing after the sample is lazy, so it is timed together with typing
+        started = time.perf_counter()
+        stats = TableStats(schema)
+        chunks = [data for _, data in iter_typed_chunks(sample, reader, schema, stats)]
+        stages['type'] = time.perf_counter() - started
+    finally:
+        reader.close()
+
+    started = time.perf_counter()
+    sink.column_types(schema, stats.as_dict(), allow_enum=True)
+    stages['plan'] = time.perf_counter() - started
+
+    # The conversion to driver rows every sink does before sending
+    started = time.perf_counter()
+    for data in chunks:
+        clean_data_for_mysql(data)
+    stages['clean'] = time.perf_counter() - started
+    return stages, schema, sum(len(data) for data in chunks)
+
+# One benchmark entry: the best and median of every stage over `repeat` runs.
+# Stages from profile_stages are prefixed 'stage.', the phases ingest_csv reports 'ingest.'.
+def benchmark_file(path, connection_details, database_type='sqlite', insert_method='insert', repeat=3,
+                   parser_engine=None, fast_load=False, name=None):
+    sink = get_sink(database_type, insert_method, fast_load)
+    runs = []
+    for _ in range(repeat):
+        stages, schema, rows = profile_stages(path, sink, parser_engine)
+        run = {f'stage.{stage}': seconds for stage, seconds in stages.items()}
+        started = time.perf_counter()
+        _, timings = ingest_csv(
+            path, 'csvupload_benchmark', connection_details, insert_method, database_type=database_type,
+            parser_engine=parser_engine, fast_load=fast_load
+        )
+        run['ingest.total'] = time.perf_counter() - started
+        run.update({f'ingest.{phase}': seconds for phase, seconds in timings.items()})
+        runs.append(run)
+
+    return {
+        'name': name or os.path.basename(path),
+        'bytes': os.path.getsize(path),
+        'rows': rows,
+        'columns': len(schema),
+        'kinds': sorted({spec['kind'] for spec in schema.values()}),
+        'min': {key: round(min(run[key] for run in runs), 4) for key in runs[0]},
+        'median': {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]},
+        'rows_per_second': round(rows / min(run['ingest.total'] for run in runs)),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def sample_files():
+    paths = [os.path.join(SAMPLES_PATH, name) for name in SAMPLE_FILES]
+    return [path for path in paths if os.path.exists(path)]
+
+# Benchmark synthetic files of each size in `rows` plus `files`, returning a JSON-ready
+# report that records the commit and settings it ran with, so runs can be compared
+def run_benchmark(connection_details, rows=(10000, 100000), columns=12, mix=None, files=(), repeat=3,
+                  database_type='sqlite', insert_method='insert', parser_engine=None, fast_load=False, seed=0):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='csvupload-benchmark-') as workdir:
+        for count in rows:
+            path = os.path.join(workdir, f'synthetic-{count}x{columns}.csv')
+            generate_csv(path, count, columns, mix, seed=seed)
+            results.append(benchmark_file(
+                path, connection_details, database_type, insert_method, repeat, parser_engine, fast_load,
+                name=f'synthetic:{count}x{columns}'
+            ))
+        for path in files:
+            results.append(benchmark_file(
+                path, connection_details, database_type, insert_method, repeat, parser_engine, fast_load,
+                name=f'sample:{os.path.basename(path)}'
+            ))
+
+    return {
+        'commit': _git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'cpus': os.cpu_count(),
+        'settings': {
+            'database_type': database_type,
+            'insert_method': insert_method,
+            'parser_engine': parser_engine or PARSER_ENGINE,
+            'fast_load': fast_load,
+            'sample_rows': SAMPLE_ROWS,
+            'chunk_rows': CHUNK_ROWS,
+            'mix': mix or DEFAULT_MIX,
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+def dump_report(report, fh):
+    json.dump(report, fh, indent=2)
+    fh.write('\n')
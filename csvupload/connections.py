@@ -0,0 +1,110 @@
+import hashlib
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+import pymysql
+from django.conf import settings
+
+# Idle connections kept per (host, port, user, database)
+POOL_MAX_SIZE = getattr(settings, 'CSVUPLOAD_POOL_MAX_SIZE', 4)
+
+# Seconds an idle connection may sit in the pool before it is closed instead of reused
+POOL_IDLE_TIMEOUT = getattr(settings, 'CSVUPLOAD_POOL_IDLE_TIMEOUT', 300)
+
+DEFAULT_PORT = 3306
+
+def _password_digest(password):
+    return hashlib.sha256((password or '').encode('utf-8')).digest()
+
+class _IdleConnection:
+    def __init__(self, connection, password_digest):
+        self.connection = connection
+        self.password_digest = password_digest
+        self.released_at = time.monotonic()
+
+# Process-wide pool of pymysql connections. A connection is only handed out again to a
+# caller presenting the same password, after an idle-timeout check and a ping.
+class ConnectionPool:
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(host, user, database, port=None, **options):
+        return (host, int(port or DEFAULT_PORT), user, database, tuple(sorted(options.items())))
+
+    def acquire(self, host, user, password, database, port=None, **options):
+        key = self.key(host, user, database, port, **options)
+        digest = _password_digest(password)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key, [])
+                entry = next((e for e in reversed(idle) if hmac.compare_digest(e.password_digest, digest)), None)
+                if entry is None:
+                    break
+                idle.remove(entry)
+            if self._is_healthy(entry):
+                return entry.connection
+            self._close(entry.connection)
+
+        return pymysql.connect(
+            host=host, user=user, password=password, database=database,
+            port=int(port or DEFAULT_PORT), **options
+        )
+
+    def release(self, connection, host, user, password, database, port=None, **options):
+        key = self.key(host, user, database, port, **options)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append(_IdleConnection(connection, _password_digest(password)))
+                return
+        self._close(connection)
+
+    # Borrow a connection for the duration of the block. It goes back to the pool only
+    # if the block finishes cleanly; on error it is closed, discarding any open transaction.
+    @contextmanager
+    def connection(self, **details):
+        connection = self.acquire(**details)
+        try:
+            yield connection
+        except BaseException:
+            self._close(connection)
+            raise
+        self.release(connection, **details)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for entries in idle.values():
+            for entry in entries:
+                self._close(entry.connection)
+
+    def _is_healthy(self, entry):
+        if time.monotonic() - entry.released_at > self.idle_timeout:
+            return False
+        try:
+            entry.connection.ping(reconnect=False)
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
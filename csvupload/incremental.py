@@ -0,0 +1,73 @@
+import pandas as pd
+from django.conf import settings
+
+# 'replace' drops and recreates the table, 'append' adds every row, 'upsert' sends only new
+# or changed rows (by key column) and 'diff' additionally deletes keys missing from the file
+LOAD_MODE = getattr(settings, 'CSVUPLOAD_LOAD_MODE', 'replace')
+
+LOAD_MODES = {'replace', 'append', 'upsert', 'diff'}
+
+KEYED_LOAD_MODES = {'upsert', 'diff'}
+
+# Load 'replace' uploads into a staging table and rename it over the target at the end,
+# so readers never see the table dropped or half loaded
+ATOMIC_REPLACE = getattr(settings, 'CSVUPLOAD_ATOMIC_REPLACE', False)
+
+STAGING_SUFFIX = '__staging'
+
+# Comparable form of a typed chunk: the same values hash the same whether they come from a
+# fresh parse (downcast ints) or from the staged Arrow file (64-bit columns)
+def canonical_frame(data, schema):
+    columns = {}
+    for col, spec in schema.items():
+        kind = spec['kind']
+        if kind == 'integer':
+            # Exact, so keys past 2**53 stay distinct
+            columns[col] = data[col].astype('Int64')
+        elif kind == 'float':
+            columns[col] = data[col].astype('float64')
+        elif kind == 'date':
+            columns[col] = data[col].astype('datetime64[ns]')
+        elif kind == 'boolean':
+            columns[col] = data[col].astype('boolean')
+        else:
+            columns[col] = data[col].astype('string')
+    return pd.DataFrame(columns, index=data.index)
+
+def canonical_keys(data, schema, key_column):
+    return canonical_frame(data, {key_column: schema[key_column]})[key_column]
+
+# One hash per row, indexed by the row's key
+def row_hashes(data, schema, key_column):
+    canonical = canonical_frame(data, schema)
+    hashes = pd.util.hash_pandas_object(canonical, index=False)
+    hashes.index = pd.Index(canonical[key_column])
+    return hashes
+
+# Row hashes of everything a previously staged upload loaded, last row winning per key
+def previous_row_hashes(staged, schema, key_column):
+    hashes = [row_hashes(data, schema, key_column) for _, data in staged.iter_chunks(list(schema))]
+    if not hashes:
+        return pd.Series([], dtype='uint64')
+    hashes = pd.concat(hashes)
+    return hashes[~hashes.index.duplicated(keep='last')]
+
+# Rows of `data` that are new or differ from the previous version. Without a previous
+# version every row counts as changed.
+def changed_rows(data, schema, key_column, previous=None):
+    if previous is None:
+        return data
+    hashes = row_hashes(data, schema, key_column)
+    known = hashes.index.isin(previous.index)
+    before = previous.reindex(hashes.index[known]).to_numpy()
+    changed = ~known
+    changed[known] = before != hashes.to_numpy()[known]
+    return data[changed]
+
+# Keys of the previous version absent from every chunk's canonical_keys, typed like the key column
+def removed_keys(previous, seen_keys, schema, key_column):
+    seen = pd.Index(pd.concat(seen_keys)) if seen_keys else pd.Index([])
+    removed = pd.Series(previous.index.difference(seen).dropna())
+    if schema[key_column]['kind'] == 'integer':
+        removed = removed.astype('int64')
+    return removed
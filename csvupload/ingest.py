@@ -0,0 +1,445 @@
+import codecs
+import csv
+import io
+import itertools
+import re
+import struct
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Rows read, typed and pushed to the database at a time
+CHUNK_ROWS = getattr(settings, 'CSVUPLOAD_CHUNK_ROWS', 50000)
+
+# Leading rows used to infer the column types for the whole file
+SAMPLE_ROWS = getattr(settings, 'CSVUPLOAD_SAMPLE_ROWS', 10000)
+
+# Processes that classify and convert column batches; 1 keeps everything in-process
+INFERENCE_WORKERS = getattr(settings, 'CSVUPLOAD_INFERENCE_WORKERS', 1)
+
+# Types wide enough for any value of the dtype; planner.plan_mysql_types narrows them
+# when statistics over the data are available
+def map_dtype_to_mysql(dtype):
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'BIGINT'
+    elif pd.api.types.is_float_dtype(dtype):
+        return 'DOUBLE'
+    elif pd.api.types.is_bool_dtype(dtype):
+        return 'BOOLEAN'
+    elif pd.api.types.is_string_dtype(dtype):
+        return 'TEXT'
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'DATETIME'
+    else:
+        return 'TEXT'
+
+# All date layouts accepted by is_date_column, combined into one precompiled pattern:
+# YYYY-MM-DD, YYYY/MM/DD, MM/DD/YYYY, DD/MM/YYYY, MM-DD-YYYY, DD-MM-YYYY,
+# MM/DD/YY, DD/MM/YY, MM-DD-YY, YYYYMMDD, DDMMYYYY, DDMMYY
+DATE_PATTERN = re.compile(
+    r'\d{4}([-/])\d{2}\1\d{2}'
+    r'|\d{2}([-/])\d{2}\2(?:\d{4}|\d{2})'
+    r'|\d{8}|\d{6}'
+)
+
+# Matches a whole sample joined with SAMPLE_SEPARATOR in a single regex scan
+SAMPLE_SEPARATOR = '\x1f'
+DATE_SAMPLE_PATTERN = re.compile(f'(?:(?:{DATE_PATTERN.pattern}){SAMPLE_SEPARATOR})*')
+
+# Number of non-null values inspected when classifying a column
+DATE_SAMPLE_VALUES = 100
+
+def leading_values(series, count):
+    head = series.head(count)
+    if head.notna().all():
+        return head
+    return series.dropna().head(count)
+
+def is_date_column(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return True
+    sample_values = leading_values(series, DATE_SAMPLE_VALUES)
+    if sample_values.empty:
+        return False
+    # Floats and booleans never render as one of the date layouts
+    if pd.api.types.is_float_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return False
+    values = [str(value) for value in sample_values]
+    joined = SAMPLE_SEPARATOR.join(values) + SAMPLE_SEPARATOR
+    if joined.count(SAMPLE_SEPARATOR) != len(values):
+        # A value contains the separator itself, so it cannot be a date
+        return False
+    return DATE_SAMPLE_PATTERN.fullmatch(joined) is not None
+
+# Candidate formats in tie-break order: when two formats parse the same share of the
+# sample (e.g. every day is <= 12), the earlier one wins
+KNOWN_DATE_FORMATS = [
+    "%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y",
+    "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%d-%m-%y",
+    "%m/%d/%y", "%m-%d-%y",
+    "%Y%m%d", "%d%m%Y", "%d%m%y"
+]
+
+# Number of values, spread across the column, each candidate format is scored on
+DATE_FORMAT_SAMPLE_VALUES = 1000
+
+# Share of those values the best format must parse; with less the column is not a date, as
+# every later value the format fails on would be loaded as NULL
+DATE_FORMAT_MIN_RATIO = 0.99
+
+def get_date_format(series):
+    values = series.dropna()
+    if len(values) > DATE_FORMAT_SAMPLE_VALUES:
+        step = len(values) // DATE_FORMAT_SAMPLE_VALUES
+        values = values.iloc[::step].head(DATE_FORMAT_SAMPLE_VALUES)
+    if values.empty:
+        return None
+    values = values.astype(str)
+
+    best_format, best_ratio = None, 0.0
+    for fmt in KNOWN_DATE_FORMATS:
+        ratio = pd.to_datetime(values, format=fmt, errors='coerce').notna().mean()
+        if ratio > best_ratio:
+            best_format, best_ratio = fmt, ratio
+            if ratio == 1.0:
+                break
+    return best_format if best_ratio >= DATE_FORMAT_MIN_RATIO else None
+
+def convert_to_datetime(series):
+    format_detected = get_date_format(series)
+    if format_detected:
+        return pd.to_datetime(series, format=format_detected, errors='coerce')
+    return pd.to_datetime(series, infer_datetime_format=True, errors='coerce')
+
+# Values inspected by detect_value_type; None scans the whole (already sampled) column
+MIXED_TYPE_SAMPLE_VALUES = getattr(settings, 'CSVUPLOAD_MIXED_TYPE_SAMPLE_VALUES', None)
+
+# infer_dtype labels for columns holding more than one kind of value
+MIXED_VALUE_TYPES = {'mixed', 'mixed-integer', 'mixed-integer-float'}
+
+# Label for the kind of values in a column ('string', 'integer', 'floating', 'boolean',
+# 'mixed-integer', ...). Typed columns are answered from their dtype; object columns are
+# scanned at C level, and the scan stops as soon as the values cannot share one type.
+def detect_value_type(series, sample_values=None):
+    sample_values = sample_values or MIXED_TYPE_SAMPLE_VALUES
+    if sample_values:
+        series = leading_values(series, sample_values)
+    return pd.api.types.infer_dtype(series, skipna=True)
+
+def has_mixed_types(series, sample_values=None):
+    return detect_value_type(series, sample_values) in MIXED_VALUE_TYPES
+
+# Text columns whose sample has at most this many distinct values, and at most this share of
+# distinct values among its non-null ones, are held as pandas Categoricals while loading
+CATEGORY_MAX_VALUES = getattr(settings, 'CSVUPLOAD_CATEGORY_MAX_VALUES', 256)
+
+CATEGORY_MAX_RATIO = getattr(settings, 'CSVUPLOAD_CATEGORY_MAX_RATIO', 0.5)
+
+def is_low_cardinality(series):
+    values = series.dropna()
+    distinct = values.nunique()
+    return 0 < distinct <= CATEGORY_MAX_VALUES and distinct <= len(values) * CATEGORY_MAX_RATIO
+
+# Accepted upload names and the compression each one implies. Compressed files are stored
+# as uploaded and pandas decompresses them while reading chunks, inferring from the suffix.
+UPLOAD_SUFFIXES = {'.csv': None, '.csv.gz': 'gzip', '.csv.zst': 'zstd', '.zip': 'zip'}
+
+UPLOAD_TYPES_ERROR = 'Allowed file types are csv, csv.gz, csv.zst and zip'
+
+# Most decompressed bytes taken from the head of a compressed upload for inspection
+INSPECT_MAX_BYTES = 1024 * 1024
+
+def upload_suffix(filename):
+    name = filename.lower()
+    return next((suffix for suffix in UPLOAD_SUFFIXES if name.endswith(suffix)), None)
+
+def open_csv_reader(filepath, chunk_rows=None, dtype=None):
+    return pd.read_csv(filepath, chunksize=chunk_rows or CHUNK_ROWS, low_memory=False, dtype=dtype)
+
+# A zip upload must hold exactly one file, and no folders, for pandas to read it
+def zip_members_error(fileobj):
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            members = archive.infolist()
+    except zipfile.BadZipFile:
+        return 'Uploaded file is not a valid zip archive'
+    if len(members) != 1 or members[0].is_dir():
+        return 'Zip archives must contain exactly one file'
+    return None
+
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+# The first bytes of a zip's first member, read from its local header without the
+# central directory at the end of the archive
+def _zip_head(head):
+    if len(head) < _ZIP_LOCAL_HEADER.size:
+        return b''
+    signature, _, flags, method, _, _, _, _, _, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack_from(head)
+    if signature != b'PK\x03\x04':
+        raise ValueError('Uploaded file is not a valid zip archive')
+    if flags & 1 or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        raise ValueError('Zip archives must be unencrypted and stored or deflated')
+    body = head[_ZIP_LOCAL_HEADER.size + name_length + extra_length:]
+    if method == zipfile.ZIP_STORED:
+        return body[:INSPECT_MAX_BYTES]
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(body, INSPECT_MAX_BYTES)
+
+# Decompress as much of the head of an upload as is available, returning the text bytes
+# and whether they are the whole file
+def decompress_head(head, compression, complete=False):
+    if compression is None:
+        return head, complete
+    if compression == 'gzip':
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            data = decompressor.decompress(head, INSPECT_MAX_BYTES)
+        except zlib.error:
+            raise ValueError('Uploaded file is not valid gzip data')
+        # All of the file went in without reaching the end of the stream: it is cut short
+        if complete and not decompressor.eof and not decompressor.unconsumed_tail:
+            raise ValueError('Uploaded file is not valid gzip data')
+        return data, complete and decompressor.eof
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('Zstandard compressed uploads require the zstandard package')
+        try:
+            data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(head)).read(INSPECT_MAX_BYTES)
+            # -1 when the frame header does not record it
+            size = zstandard.frame_content_size(head) if complete else -1
+        except zstandard.ZstdError:
+            raise ValueError('Uploaded file is not valid zstandard data')
+        if len(data) < min(size, INSPECT_MAX_BYTES):
+            raise ValueError('Uploaded file is not valid zstandard data')
+        return data, complete and len(data) < INSPECT_MAX_BYTES
+    if complete:
+        message = zip_members_error(io.BytesIO(head))
+        if message:
+            raise ValueError(message)
+        try:
+            with zipfile.ZipFile(io.BytesIO(head)) as archive:
+                with archive.open(archive.infolist()[0]) as member:
+                    data = member.read(INSPECT_MAX_BYTES)
+        except (zipfile.BadZipFile, NotImplementedError, RuntimeError, zlib.error):
+            raise ValueError('Zip archives must be unencrypted and stored or deflated')
+        return data, len(data) < INSPECT_MAX_BYTES
+    try:
+        return _zip_head(head), False
+    except zlib.error:
+        raise ValueError('Uploaded file is not a valid zip archive')
+
+# Delimiters a file's head is sniffed for; only comma separated files are parsed
+SNIFF_DELIMITERS = ',;\t|'
+
+# Check the first bytes of an upload, before the rest of it has arrived. `complete` says
+# `head` is the whole file. Returns why the file cannot be parsed, or None if it looks fine.
+def inspect_csv_head(head, complete=False, compression=None):
+    try:
+        head, complete = decompress_head(head, compression, complete)
+    except ValueError as e:
+        return str(e)
+    if complete and not head.strip():
+        return 'Uploaded file is empty'
+    if b'\x00' in head:
+        return 'Uploaded file is not a text file'
+    try:
+        text = codecs.getincrementaldecoder('utf-8-sig')().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return 'Uploaded file is not UTF-8 encoded text'
+    if not complete:
+        # Only whole lines can be judged
+        text = text[:text.rfind('\n') + 1]
+
+    reader = csv.reader(io.StringIO(text))
+    header = next((row for row in reader if row), None)
+    if header is None:
+        return None
+    if len(header) == 1:
+        try:
+            delimiter = csv.Sniffer().sniff(text, delimiters=SNIFF_DELIMITERS).delimiter
+        except csv.Error:
+            delimiter = ','
+        if delimiter != ',':
+            return f"File appears to be delimited by {delimiter!r}; only comma separated files are supported"
+    for row in reader:
+        if len(row) > len(header):
+            return f"Expected {len(header)} fields in line {reader.line_num}, saw {len(row)}"
+    return None
+
+def classify_column(series):
+    if series.isna().all():
+        # Nothing to go on in the sample: text holds whatever comes later
+        return {'kind': 'string'}
+    if is_date_column(series):
+        # Only a known format converts later values; anything else stays text
+        date_format = get_date_format(series)
+        if date_format:
+            return {'kind': 'date', 'format': date_format}
+
+    value_type = detect_value_type(series)
+    if value_type == 'mixed-integer-float':
+        # Only numbers, some written as integers: keep it numeric
+        return {'kind': 'float'}
+    elif value_type in MIXED_VALUE_TYPES:
+        return {'kind': 'string', 'value_type': value_type}
+    elif value_type == 'boolean':
+        return {'kind': 'boolean'}
+    elif value_type == 'integer':
+        return {'kind': 'integer'}
+    elif value_type == 'floating':
+        return {'kind': 'float'}
+    elif is_low_cardinality(series):
+        return {'kind': 'string', 'categorical': True}
+    return {'kind': 'string'}
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=INFERENCE_WORKERS)
+        return _process_pool
+
+# Split the columns into one contiguous batch per worker
+def column_batches(columns, workers):
+    columns = list(columns)
+    size = -(-len(columns) // workers)
+    return [columns[start:start + size] for start in range(0, len(columns), size)]
+
+def _use_process_pool(frame, workers):
+    return workers > 1 and len(frame.columns) > 1 and not frame.empty
+
+def _classify_batch(frame):
+    return {col: classify_column(frame[col]) for col in frame.columns}
+
+# Decide once, from the leading sample, how every column is typed for the whole file.
+# The verdict per column is kept in the schema so chunks are never re-classified.
+def infer_schema(sample, workers=None):
+    sample = sample.dropna(how='all')
+    workers = workers or INFERENCE_WORKERS
+    if not _use_process_pool(sample, workers):
+        return _classify_batch(sample)
+
+    batches = [sample[cols] for cols in column_batches(sample.columns, workers)]
+    schema = {}
+    for verdicts in get_process_pool().map(_classify_batch, batches):
+        schema.update(verdicts)
+    return {col: schema[col] for col in sample.columns}
+
+# Representative dtype per schema kind, enough to pick the target column types
+SCHEMA_KIND_DTYPES = {
+    'date': 'datetime64[ns]',
+    'integer': 'int64',
+    'float': 'float64',
+    'boolean': 'boolean',
+    'string': 'string',
+}
+
+def schema_dtypes(schema):
+    return {col: pd.api.types.pandas_dtype(SCHEMA_KIND_DTYPES[spec['kind']]) for col, spec in schema.items()}
+
+# Raised while typing a chunk holding values the sample's kind for `column` cannot: an integer
+# column with fractions widens to 'float', a numeric or boolean column with text to 'string'.
+# iter_typed_chunks fills in `schema`, the schema to parse the upload again with.
+class ColumnWidened(Exception):
+    def __init__(self, column, kind, schema=None):
+        super().__init__(column, kind, schema)
+        self.column = column
+        self.kind = kind
+        self.schema = schema
+
+    def __str__(self):
+        return f"Column '{self.column}' has values after the sampled rows that only fit a {self.kind} column"
+
+def _to_numeric(series, col, kind):
+    if pd.api.types.is_numeric_dtype(series):
+        converted = pd.to_numeric(series, errors='coerce')
+    else:
+        # Text parsed to nullable dtypes keeps integers exact; through float64 9007199254740993
+        # would load as 9007199254740992
+        converted = pd.to_numeric(series, errors='coerce', dtype_backend='numpy_nullable')
+    if (converted.isna() & series.notna()).any():
+        raise ColumnWidened(col, 'string')
+    if kind == 'float':
+        # Never float32: its values reach the driver as e.g. 0.10000000149011612
+        return converted.astype('float64')
+    if (converted.notna() & (converted % 1 != 0)).any():
+        raise ColumnWidened(col, 'float')
+    if converted.isna().any():
+        # Integers with gaps are held as nullable Int64, never as floats a sink writes as 6.0
+        return converted.astype('Int64')
+    if isinstance(converted.dtype, pd.api.extensions.ExtensionDtype):
+        converted = converted.astype(converted.dtype.numpy_dtype)
+    return pd.to_numeric(converted, downcast='integer')
+
+def _apply_batch(chunk, schema):
+    for col, spec in schema.items():
+        kind = spec['kind']
+        if kind == 'date':
+            chunk[col] = pd.to_datetime(chunk[col], format=spec['format'], errors='coerce')
+        elif kind in ('integer', 'float'):
+            chunk[col] = _to_numeric(chunk[col], col, kind)
+        elif kind == 'boolean':
+            try:
+                chunk[col] = chunk[col].astype('boolean')
+            except (TypeError, ValueError):
+                raise ColumnWidened(col, 'string')
+        elif spec.get('categorical'):
+            chunk[col] = chunk[col].astype('string').astype('category')
+        else:
+            chunk[col] = chunk[col].astype('string')
+    return chunk
+
+# Type a raw chunk according to the schema inferred from the sample
+def apply_schema(chunk, schema, workers=None):
+    chunk = chunk.dropna(how='all')
+    workers = workers or INFERENCE_WORKERS
+    if not _use_process_pool(chunk, workers):
+        return _apply_batch(chunk, schema)
+
+    batches = column_batches(schema, workers)
+    typed = get_process_pool().map(
+        _apply_batch,
+        [chunk[cols] for cols in batches],
+        [{col: schema[col] for col in cols} for cols in batches],
+    )
+    return pd.concat(list(typed), axis=1)[list(schema)]
+
+# Give a categorical column the same categories in every chunk: those seen so far, with the
+# chunk's new values appended, so codes stay stable and the dictionary only ever grows. A
+# dictionary outgrowing the limits the sample was held to widens the column to plain text.
+def _extend_dictionaries(typed, schema, dictionaries):
+    for col, spec in schema.items():
+        if spec.get('categorical'):
+            categories = typed[col].cat.categories
+            known, values = dictionaries.get(col, (None, 0))
+            known = categories if known is None else known.append(categories.difference(known))
+            values += typed[col].count()
+            if len(known) > CATEGORY_MAX_VALUES or len(known) > values * CATEGORY_MAX_RATIO:
+                raise ColumnWidened(col, 'string')
+            dictionaries[col] = known, values
+            typed[col] = typed[col].cat.set_categories(known)
+
+# Yield (rows read, typed chunk) pairs, starting with the sample the schema was inferred from.
+# `reader` is a parsers chunk reader; `stats`, a planner.TableStats, is updated with every chunk.
+# Raises ColumnWidened when a chunk does not fit the schema.
+def iter_typed_chunks(sample, reader, schema, stats=None):
+    dictionaries = {}
+    try:
+        for chunk in itertools.chain([sample], reader.chunks(schema)):
+            typed = apply_schema(chunk, schema)
+            _extend_dictionaries(typed, schema, dictionaries)
+            if stats is not None:
+                stats.update(chunk, typed)
+            yield len(chunk), typed
+    except ColumnWidened as e:
+        raise ColumnWidened(e.column, e.kind, {**schema, e.column: {'kind': e.kind}}) from None
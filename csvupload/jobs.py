@@ -0,0 +1,54 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import UploadJob
+from .pipeline import IngestError, ingest_csv
+
+# Uploads ingested concurrently by this process
+JOB_WORKERS = getattr(settings, 'CSVUPLOAD_JOB_WORKERS', 4)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='csvupload-job')
+        return _executor
+
+# Record the job and hand it to the worker pool. The connection details, including
+# the password, only live in the worker's memory and are never written to the job row.
+def submit_upload_job(filepath, filename, table_name, connection_details, insert_method,
+                      database_type=None, digest=None, **load_options):
+    job = UploadJob.objects.create(table_name=table_name, filename=filename)
+    get_executor().submit(
+        run_upload_job, job.pk, filepath, table_name, connection_details, insert_method, database_type, digest,
+        **load_options
+    )
+    return job
+
+# `load_options` are passed through to ingest_csv (load_mode, key_column, atomic, index_columns, fast_load,
+# parser_engine)
+def run_upload_job(job_id, filepath, table_name, connection_details, insert_method, database_type=None, digest=None,
+                   **load_options):
+    jobs = UploadJob.objects.filter(pk=job_id)
+
+    def progress(rows_parsed, rows_inserted):
+        jobs.update(rows_parsed=rows_parsed, rows_inserted=rows_inserted)
+
+    try:
+        jobs.update(status=UploadJob.STATUS_RUNNING, started_at=timezone.now())
+        column_details, timings = ingest_csv(
+            filepath, table_name, connection_details, insert_method,
+            progress=progress, database_type=database_type, digest=digest, **load_options
+        )
+        jobs.update(status=UploadJob.STATUS_SUCCEEDED, columns=column_details, timings=timings, finished_at=timezone.now())
+    except IngestError as e:
+        jobs.update(status=UploadJob.STATUS_FAILED, error=e.error, message=e.message or '', finished_at=timezone.now())
+    except Exception as e:
+        jobs.update(status=UploadJob.STATUS_FAILED, error='Error processing upload', message=str(e), finished_at=timezone.now())
+    finally:
+        close_old_connections()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import pandas as pd
+from django.conf import settings
+
+# Rows handed to a single executemany() call
+INSERT_BATCH_ROWS = getattr(settings, 'CSVUPLOAD_INSERT_BATCH_ROWS', 5000)
+
+# 'insert' for batched parameterized INSERTs, 'load_data' for LOAD DATA LOCAL INFILE
+INSERT_METHOD = getattr(settings, 'CSVUPLOAD_INSERT_METHOD', 'insert')
+
+INSERT_METHODS = {'insert', 'load_data'}
+
+def quote_identifier(name):
+    return '`' + str(name).replace('`', '``') + '`'
+
+# Identifiers inside parameterized statements must not be mistaken for placeholders
+def _param_identifier(name):
+    return quote_identifier(name).replace('%', '%%')
+
+# Rows for the driver with None in place of NaN/NaT/NA. Columns without nulls go
+# straight from their buffers to Python values; only columns that have nulls are
+# boxed to object, and only for the rows of this batch.
+def clean_data_for_mysql(data):
+    columns = []
+    for col in data.columns:
+        series = data[col]
+        mask = series.isna().to_numpy()
+        if mask.any():
+            values = series.astype(object).to_numpy()
+            values[mask] = None
+            columns.append(values.tolist())
+        else:
+            columns.append(series.tolist())
+    return list(zip(*columns))
+
+def insert_rows(cursor, table_name, data, batch_size=None):
+    batch_size = batch_size or INSERT_BATCH_ROWS
+    columns = ', '.join(_param_identifier(col) for col in data.columns)
+    placeholders = ', '.join(['%s'] * len(data.columns))
+    # pymysql rewrites this into multi-row INSERT statements
+    insert_query = f"INSERT INTO {_param_identifier(table_name)} ({columns}) VALUES ({placeholders})"
+
+    for start in range(0, len(data), batch_size):
+        cursor.executemany(insert_query, clean_data_for_mysql(data.iloc[start:start + batch_size]))
+
+def _tsv_column(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        text = series.dt.strftime('%Y-%m-%d %H:%M:%S').astype('string')
+    elif pd.api.types.is_bool_dtype(series):
+        text = series.astype('Int8').astype('string')
+    elif pd.api.types.is_numeric_dtype(series):
+        text = series.astype('string')
+    else:
+        text = (series.astype('string')
+                .str.replace('\\', '\\\\', regex=False)
+                .str.replace('\t', '\\t', regex=False)
+                .str.replace('\n', '\\n', regex=False)
+                .str.replace('\r', '\\r', regex=False))
+    return text.fillna('\\N')
+
+# Serialize a typed frame in the default LOAD DATA format: tab separated, backslash escaped, \N for NULL
+def write_tsv(data, fh):
+    columns = [_tsv_column(data[col]) for col in data.columns]
+    lines = columns[0].str.cat(columns[1:], sep='\t')
+    for start in range(0, len(lines), INSERT_BATCH_ROWS):
+        fh.write('\n'.join(lines.iloc[start:start + INSERT_BATCH_ROWS]))
+        fh.write('\n')
+
+# Requires the connection to be opened with local_infile=True
+def load_data_infile(cursor, table_name, data):
+    if data.empty:
+        return
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as fh:
+            write_tsv(data, fh)
+        columns = ', '.join(_param_identifier(col) for col in data.columns)
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {_param_identifier(table_name)} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            f"LINES TERMINATED BY '\\n' ({columns})",
+            (path,)
+        )
+    finally:
+        os.remove(path)
@@ -0,0 +1,90 @@
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from csvupload import sinks
+from csvupload.benchmark import DEFAULT_MIX, dump_report, parse_mix, run_benchmark, sample_files
+from csvupload.parsers import PARSER_ENGINES
+
+SQLITE_DATABASE = 'csvupload_benchmark.sqlite3'
+
+class Command(BaseCommand):
+    help = ('Time every stage of the ingest pipeline on synthetic CSVs and the uploads/ samples, '
+            'writing a JSON report that can be compared across commits')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10000,100000', help='Comma separated row counts of synthetic files')
+        parser.add_argument('--columns', type=int, default=12)
+        parser.add_argument('--mix', default='', help=f"Column kind weights, e.g. 'date=3,long=1' "
+                                                      f"(kinds: {', '.join(sorted(DEFAULT_MIX))})")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-samples', action='store_true', help='Skip the uploads/ samples')
+        parser.add_argument('--file', action='append', default=[], help='Benchmark this CSV as well')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--database-type', default='sqlite', choices=sorted(sinks.SINKS))
+        parser.add_argument('--insert-method', default='insert')
+        parser.add_argument('--parser-engine', choices=sorted(PARSER_ENGINES))
+        parser.add_argument('--fast-load', action='store_true')
+        parser.add_argument('--host')
+        parser.add_argument('--port', type=int)
+        parser.add_argument('--user')
+        parser.add_argument('--password')
+        parser.add_argument('--database', help='Target database; SQLite runs use a scratch file by default')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--compare', help='A previous report to compare the best timings against')
+
+    def handle(self, *args, **options):
+        try:
+            rows = [int(count) for count in options['rows'].split(',') if count.strip()]
+            mix = parse_mix(options['mix']) or None
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        database_type = options['database_type']
+        database = options['database'] or (SQLITE_DATABASE if database_type == 'sqlite' else None)
+        if not database:
+            raise CommandError(f'--database is required for {database_type}')
+        connection_details = {
+            'host': options['host'], 'port': options['port'], 'user': options['user'],
+            'password': options['password'], 'database': database,
+        }
+        if database_type == 'sqlite':
+            connection_details = {'database': database}
+
+        try:
+            report = run_benchmark(
+                connection_details, rows, options['columns'], mix,
+                files=options['file'] + ([] if options['no_samples'] else sample_files()),
+                repeat=options['repeat'], database_type=database_type, insert_method=options['insert_method'],
+                parser_engine=options['parser_engine'], fast_load=options['fast_load'], seed=options['seed'],
+            )
+        finally:
+            if database_type == 'sqlite' and not options['database']:
+                scratch = os.path.join(sinks.SQLITE_ROOT, SQLITE_DATABASE)
+                if os.path.exists(scratch):
+                    os.remove(scratch)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                dump_report(report, fh)
+        else:
+            dump_report(report, self.stdout)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as fh:
+                self.compare(json.load(fh), report)
+
+    # Ratio of every best timing to the same entry in `baseline`; below 1 is faster.
+    # Written to stderr, since stdout may be carrying the report itself.
+    def compare(self, baseline, report):
+        before = {result['name']: result['min'] for result in baseline['results']}
+        out = self.stderr
+        out.write(f"Compared with {baseline.get('commit') or 'baseline'}:")
+        for result in report['results']:
+            if result['name'] not in before:
+                continue
+            out.write(f"  {result['name']}")
+            for key, seconds in result['min'].items():
+                if before[result['name']].get(key):
+                    out.write(f"    {key:<16} {seconds:9.4f}s  x{seconds / before[result['name']][key]:.2f}")
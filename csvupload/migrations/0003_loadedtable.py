@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csvupload', '0002_uploadjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadedTable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('database_type', models.CharField(max_length=32)),
+                ('host', models.CharField(blank=True, max_length=255)),
+                ('port', models.IntegerField(blank=True, null=True)),
+                ('database', models.CharField(max_length=255)),
+                ('table_name', models.CharField(max_length=255)),
+                ('digest', models.CharField(max_length=64)),
+                ('load_mode', models.CharField(max_length=16)),
+                ('key_column', models.CharField(blank=True, max_length=255)),
+                ('loaded_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('database_type', 'host', 'port', 'database', 'table_name')},
+            },
+        ),
+    ]
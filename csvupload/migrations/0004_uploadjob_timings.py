@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('csvupload', '0003_loadedtable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
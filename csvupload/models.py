@@ -1,7 +1,73 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 
 class CSVData(models.Model):
     data_field = models.CharField(max_length=255)
 
     def __str__(self):
-        return self.data_field
\ No newline at end of file
+        return self.data_field
+
+class UploadJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    table_name = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    rows_parsed = models.BigIntegerField(default=0)
+    rows_inserted = models.BigIntegerField(default=0)
+    columns = models.JSONField(null=True, blank=True)
+    timings = models.JSONField(null=True, blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.table_name} ({self.status})"
+
+    def as_dict(self):
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds() if self.started_at else 0
+        return {
+            'job_id': str(self.id),
+            'status': self.status,
+            'table_name': self.table_name,
+            'rows_parsed': self.rows_parsed,
+            'rows_inserted': self.rows_inserted,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.rows_inserted / elapsed, 1) if elapsed else None,
+            'columns': self.columns,
+            'timings': self.timings,
+            'error': self.error or None,
+            'message': self.message or None,
+        }
+
+# The upload last loaded into a target table, so the next keyed load can compare against it
+class LoadedTable(models.Model):
+    database_type = models.CharField(max_length=32)
+    host = models.CharField(max_length=255, blank=True)
+    port = models.IntegerField(null=True, blank=True)
+    database = models.CharField(max_length=255)
+    table_name = models.CharField(max_length=255)
+    digest = models.CharField(max_length=64)
+    load_mode = models.CharField(max_length=16)
+    key_column = models.CharField(max_length=255, blank=True)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('database_type', 'host', 'port', 'database', 'table_name')
+
+    def __str__(self):
+        return f"{self.database}.{self.table_name} ({self.digest[:12]})"
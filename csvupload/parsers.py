@@ -0,0 +1,160 @@
+import re
+import zipfile
+import pandas as pd
+from django.conf import settings
+from .ingest import CHUNK_ROWS, ColumnWidened, open_csv_reader, upload_suffix
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+# 'pandas' (the C parser) or 'pyarrow' (Arrow's multithreaded CSV reader); requests may override it
+PARSER_ENGINE = getattr(settings, 'CSVUPLOAD_PARSER_ENGINE', 'pandas')
+
+PARSER_ENGINES = {'pandas', 'pyarrow'}
+
+# pandas' default NA markers, so both engines read the same cells as missing
+NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+# Reads an upload as a leading sample, then as raw chunks for the schema inferred from it
+class PandasChunkReader:
+    def __init__(self, filepath, chunk_rows=None):
+        self.filepath = filepath
+        self.chunk_rows = chunk_rows or CHUNK_ROWS
+        self._reader = open_csv_reader(filepath, self.chunk_rows)
+        self.rows_read = 0
+        self.columns = []
+
+    def read_sample(self, rows):
+        sample = self._reader.get_chunk(rows)
+        self.rows_read = len(sample)
+        self.columns = list(sample.columns)
+        return self._exact_integers(sample)
+
+    # pandas reads an integer column with blanks as float64, rounding values past 2**53. Those
+    # columns are read again as nullable Int64, so they classify as integers and stay exact.
+    def _exact_integers(self, sample):
+        floats = [i for i, col in enumerate(sample.columns) if pd.api.types.is_float_dtype(sample[col])]
+        if not floats:
+            return sample
+        exact = pd.read_csv(
+            self.filepath, nrows=self.rows_read, usecols=floats, low_memory=False, dtype_backend='numpy_nullable'
+        )
+        for col in exact.columns:
+            if isinstance(exact[col].dtype, pd.Int64Dtype):
+                sample[col] = exact[col]
+        return sample
+
+    # The file is read again with text, date and integer columns kept as text, so a chunk
+    # whose values all look numeric is not converted (losing leading zeros) and integers are
+    # never rounded through floats; the sample rows are skipped
+    def chunks(self, schema):
+        self._reader.close()
+        text_columns = {col: str for col, spec in schema.items() if spec['kind'] in ('string', 'date', 'integer')}
+        self._reader = open_csv_reader(self.filepath, self.chunk_rows, dtype=text_columns)
+        if self.rows_read:
+            self._reader.get_chunk(self.rows_read)
+        return iter(self._reader)
+
+    def close(self):
+        self._reader.close()
+
+# The sample still comes from pandas, so inference sees exactly what it sees with the pandas
+# engine. The rest of the file is converted by Arrow on all cores, straight to the column
+# types the schema settled on, and handed on in chunks of `chunk_rows` rows.
+class ArrowChunkReader(PandasChunkReader):
+    def __init__(self, filepath, chunk_rows=None):
+        if pa is None:
+            raise ValueError("The 'pyarrow' parser engine requires the pyarrow package")
+        super().__init__(filepath, chunk_rows)
+        self._archive = None
+
+    def _open_source(self):
+        if upload_suffix(self.filepath) == '.zip':
+            self._archive = zipfile.ZipFile(self.filepath)
+            return self._archive.open(self._archive.infolist()[0])
+        # gzip and zstandard are recognized from the suffix
+        return pa.input_stream(self.filepath, compression='detect')
+
+    def _convert_options(self, schema):
+        arrow_types = {'integer': pa.int64(), 'float': pa.float64(), 'boolean': pa.bool_()}
+        return pa_csv.ConvertOptions(
+            column_types={col: arrow_types.get(spec['kind'], pa.string()) for col, spec in schema.items()},
+            null_values=NA_VALUES,
+            true_values=['True', 'TRUE', 'true'],
+            false_values=['False', 'FALSE', 'false'],
+            strings_can_be_null=True,
+        )
+
+    # Report Arrow's failures the way the pandas engine reports the same input: a value the
+    # column's type cannot hold widens the column
+    def _error(self, error, schema):
+        match = re.match(r"In CSV column #(\d+): (?:Row #\d+: )?CSV conversion error.*invalid value '(.*)'$", str(error), re.S)
+        if match and int(match.group(1)) < len(self.columns):
+            col = self.columns[int(match.group(1))]
+            if schema[col]['kind'] == 'integer' and pd.notna(pd.to_numeric(match.group(2), errors='coerce')):
+                return ColumnWidened(col, 'float')
+            if schema[col]['kind'] in ('integer', 'float', 'boolean'):
+                return ColumnWidened(col, 'string')
+            return ValueError(f"Column '{col}' has values that do not match its type: {error}")
+        return pd.errors.ParserError(str(error))
+
+    def chunks(self, schema):
+        self._reader.close()
+        source = self._open_source()
+        try:
+            reader = pa_csv.open_csv(
+                source,
+                read_options=pa_csv.ReadOptions(use_threads=True, column_names=self.columns, skip_rows=1),
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                convert_options=self._convert_options(schema),
+            )
+            # The sample's rows are dropped once parsed: skipping them by line would also count
+            # the blank lines pandas passed over
+            start, pending, skip = self.rows_read, None, self.rows_read
+            while True:
+                try:
+                    batch = reader.read_next_batch()
+                except StopIteration:
+                    batch = None
+                if batch is not None:
+                    batch = pa.Table.from_batches([batch])
+                    dropped = min(skip, batch.num_rows)
+                    batch, skip = batch.slice(dropped), skip - dropped
+                    pending = batch if pending is None else pa.concat_tables([pending, batch])
+                # Cut chunks exactly where the pandas engine would, so categorical
+                # dictionaries grow the same way and staged output is identical
+                while pending is not None and (pending.num_rows >= self.chunk_rows or batch is None):
+                    chunk = pending.slice(0, self.chunk_rows)
+                    pending = pending.slice(self.chunk_rows) if pending.num_rows > self.chunk_rows else None
+                    if not chunk.num_rows:
+                        break
+                    # Integer columns with nulls as Int64 rather than rounded floats
+                    chunk = chunk.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+                    chunk.index = pd.RangeIndex(start, start + len(chunk))
+                    start += len(chunk)
+                    yield chunk
+                if batch is None:
+                    return
+        except pa.ArrowInvalid as e:
+            raise self._error(e, schema) from e
+        finally:
+            source.close()
+
+    def close(self):
+        super().close()
+        if self._archive is not None:
+            self._archive.close()
+
+PARSER_READERS = {'pandas': PandasChunkReader, 'pyarrow': ArrowChunkReader}
+
+def open_chunk_reader(filepath, engine=None, chunk_rows=None):
+    engine = engine or PARSER_ENGINE
+    if engine not in PARSER_READERS:
+        raise ValueError(f"parser_engine must be one of {', '.join(sorted(PARSER_ENGINES))}")
+    return PARSER_READERS[engine](filepath, chunk_rows)
@@ -0,0 +1,246 @@
+import time
+from contextlib import contextmanager
+import pandas as pd
+from .ingest import SAMPLE_ROWS, ColumnWidened, infer_schema, iter_typed_chunks
+from .incremental import KEYED_LOAD_MODES, STAGING_SUFFIX, canonical_keys, changed_rows, previous_row_hashes, removed_keys
+from .models import LoadedTable
+from .parsers import open_chunk_reader
+from .planner import TableStats
+from .sinks import get_sink, open_cursor
+from .storage import TYPED_CACHE, StagedUpload
+
+# Carries the error/message/status triple the upload endpoints answer with
+class IngestError(Exception):
+    def __init__(self, error, message=None, status=500):
+        super().__init__(message or error)
+        self.error = error
+        self.message = message
+        self.status = status
+
+    def as_dict(self):
+        data = {'error': self.error}
+        if self.message is not None:
+            data['message'] = self.message
+        return data
+
+def open_upload(filepath, parser_engine=None):
+    try:
+        # Stream the file in chunks; the leading sample drives type inference
+        reader = open_chunk_reader(filepath, parser_engine)
+        sample = reader.read_sample(SAMPLE_ROWS)
+    except pd.errors.ParserError as e:
+        raise IngestError('Error parsing CSV file', str(e))
+    except Exception as e:
+        raise IngestError('Error reading file', str(e))
+
+    if sample.empty:
+        reader.close()
+        raise IngestError('Uploaded file is empty', status=400)
+    return reader, sample
+
+def _loaded_table(sink, connection_details, table_name):
+    return {
+        'database_type': sink.database_type,
+        'host': connection_details.get('host') or '',
+        'port': connection_details.get('port'),
+        'database': connection_details['database'],
+        'table_name': table_name,
+    }
+
+# Row hashes of the upload previously loaded into this table with the same columns, or None.
+# After an upsert the table may still hold keys that upload lacked, so a diff cannot rely on it.
+def _previous_version(target, schema, load_mode, key_column):
+    loaded = LoadedTable.objects.filter(**target).first()
+    if loaded is None or (load_mode == 'diff' and loaded.load_mode == 'upsert'):
+        return None
+    staged = StagedUpload(loaded.digest)
+    if staged.load_schema() != schema:
+        return None
+    return previous_row_hashes(staged, schema, key_column)
+
+@contextmanager
+def _phase(timings, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - started
+
+# Iterate, adding the time spent producing each item to timings[name]
+def _timed(iterable, timings, name):
+    iterator = iter(iterable)
+    while True:
+        with _phase(timings, name):
+            item = next(iterator, None)
+        if item is None:
+            return
+        yield item
+
+# Parse, type and load a saved CSV into `table_name`, returning the column types.
+# `progress`, if given, is called with (rows_parsed, rows_inserted) after every chunk.
+# With the upload's content `digest`, a typed result staged from the same bytes is loaded
+# directly; a fresh parse is staged in full first, so column types can be planned from
+# statistics over every row, and kept for next time.
+# `load_mode` is one of incremental.LOAD_MODES; 'upsert' and 'diff' compare the file against
+# the version last loaded into the table by `key_column` and only send the rows that changed.
+# `atomic` loads a 'replace' into a staging table that is renamed over the target at the end.
+# `index_columns` (and the key column) are indexed when the table is created; with `fast_load`
+# the indexes are built after the rows are in. `parser_engine` picks the CSV parser (see
+# parsers.PARSER_ENGINES). Also returns the seconds spent in each phase.
+# A value after the sample that does not fit its column's kind widens the column, and the
+# upload is parsed and loaded again from the start; nothing from the attempt is kept.
+def ingest_csv(filepath, table_name, connection_details, insert_method='insert', progress=None,
+               database_type=None, digest=None, load_mode='replace', key_column=None, atomic=False,
+               index_columns=None, fast_load=False, parser_engine=None):
+    schema = None
+    while True:
+        try:
+            return _ingest_csv(
+                filepath, table_name, connection_details, insert_method, progress, database_type, digest,
+                load_mode, key_column, atomic, index_columns, fast_load, parser_engine, schema
+            )
+        except ColumnWidened as e:
+            schema = e.schema
+
+# One attempt at ingest_csv; with `schema` the file is parsed with it instead of inferring one
+def _ingest_csv(filepath, table_name, connection_details, insert_method, progress, database_type, digest,
+                load_mode, key_column, atomic, index_columns, fast_load, parser_engine, schema=None):
+    sink = get_sink(database_type, insert_method, fast_load)
+    timings = dict.fromkeys(('read', 'create', 'load', 'index', 'commit'), 0.0)
+    staged = StagedUpload(digest) if digest else None
+    cached_schema = staged.load_schema() if staged and schema is None else None
+    reader = None
+    try:
+        rows_staged = 0
+        with _phase(timings, 'read'):
+            if cached_schema is None:
+                reader, sample = open_upload(filepath, parser_engine)
+                try:
+                    schema = schema or infer_schema(sample)
+                except Exception as e:
+                    raise IngestError('Error processing data', str(e))
+                stats = TableStats(schema)
+                typed_chunks = iter_typed_chunks(sample, reader, schema, stats)
+                if staged and TYPED_CACHE:
+                    # Column types are planned from statistics over every row, so the whole
+                    # file is staged before the table is created
+                    try:
+                        for rows_read, _ in staged.record(schema, typed_chunks, stats):
+                            rows_staged += rows_read
+                            if progress:
+                                progress(rows_staged, 0)
+                    except pd.errors.ParserError as e:
+                        raise IngestError('Error parsing CSV file', str(e))
+                    except ValueError as e:
+                        raise IngestError('Error processing data', str(e))
+                    stats = stats.as_dict()
+                    typed_chunks = staged.iter_chunks()
+                else:
+                    # Loading while parsing: only the kinds are known when the table is created
+                    stats = None
+            else:
+                # These bytes were parsed before: skip parsing and inference entirely
+                schema = cached_schema
+                stats = staged.load_stats()
+                typed_chunks = staged.iter_chunks()
+
+        # Collect column names and their data types. A table later loads add to is created with
+        # types wide enough for any value; only the types this load needs are fitted to its data.
+        planned_types = sink.column_types(schema, stats, allow_enum=load_mode == 'replace')
+        column_details = planned_types if load_mode == 'replace' else sink.column_types(schema)
+
+        if load_mode in KEYED_LOAD_MODES and key_column not in schema:
+            raise IngestError('Error processing data', f"Key column '{key_column}' is not in the file", status=400)
+
+        index_columns = list(dict.fromkeys(list(index_columns or ()) + ([key_column] if key_column else [])))
+        missing = [col for col in index_columns if col not in schema]
+        if missing:
+            raise IngestError('Error processing data', f"Index columns not in the file: {', '.join(missing)}", status=400)
+
+        target = _loaded_table(sink, connection_details, table_name)
+        previous = _previous_version(target, schema, load_mode, key_column) if load_mode in KEYED_LOAD_MODES else None
+        load_table = table_name + STAGING_SUFFIX if load_mode == 'replace' and atomic else table_name
+
+        try:
+            rows_parsed, rows_inserted = rows_staged, 0
+            seen_keys = []
+            with sink.connect(connection_details) as connection, open_cursor(connection) as cursor, \
+                    sink.bulk_session(connection, cursor):
+                with _phase(timings, 'create'):
+                    if load_mode == 'replace':
+                        # Drop the table if it exists and create it again
+                        sink.create_table(cursor, load_table, column_details)
+                        created = True
+                    else:
+                        created = not sink.table_exists(cursor, table_name)
+                        sink.create_table(cursor, table_name, column_details, replace=False)
+                        if not created:
+                            # Columns typed for earlier loads may be too narrow for this one
+                            sink.widen_columns(cursor, table_name, planned_types)
+                        # The previous version only stands for the table while the table still holds
+                        # its keys; one dropped or edited since is loaded in full
+                        if previous is not None and (
+                            created or sink.count_keys(cursor, table_name, key_column, schema[key_column]['kind'] == 'string')
+                            != previous.index.notna().sum()
+                        ):
+                            previous = None
+                        if load_mode == 'diff' and previous is None:
+                            # Nothing to compare against: rewrite the contents inside the transaction
+                            sink.delete_all(cursor, table_name)
+
+                index_columns = index_columns if created else []
+                if not sink.fast_load:
+                    with _phase(timings, 'index'):
+                        sink.create_indexes(cursor, load_table, index_columns, column_details)
+
+                # Type and load each chunk as soon as it is read
+                for rows_read, data in _timed(typed_chunks, timings, 'read'):
+                    if not rows_staged:
+                        rows_parsed += rows_read
+                    with _phase(timings, 'load'):
+                        if load_mode in KEYED_LOAD_MODES:
+                            if load_mode == 'diff' and previous is not None:
+                                seen_keys.append(canonical_keys(data, schema, key_column))
+                            data = changed_rows(data, schema, key_column, previous)
+                            sink.delete_keys(cursor, table_name, key_column, data[key_column])
+                        # Typed columns go to the sink as-is; NULLs are normalized at the driver boundary
+                        sink.load(cursor, load_table, data)
+                    rows_inserted += len(data)
+                    if progress:
+                        progress(rows_parsed, rows_inserted)
+
+                with _phase(timings, 'load'):
+                    if load_mode == 'diff' and previous is not None:
+                        sink.delete_keys(cursor, table_name, key_column, removed_keys(previous, seen_keys, schema, key_column))
+
+                # A fast load builds its indexes once, over all the rows
+                if sink.fast_load:
+                    with _phase(timings, 'index'):
+                        sink.create_indexes(cursor, load_table, index_columns, column_details)
+
+                with _phase(timings, 'commit'):
+                    connection.commit()
+                    if load_table != table_name:
+                        sink.swap_tables(connection, cursor, load_table, table_name)
+        except ColumnWidened:
+            raise
+        except sink.database_errors as e:
+            raise IngestError('Database error', str(e))
+        except pd.errors.ParserError as e:
+            raise IngestError('Error parsing CSV file', str(e))
+        except ValueError as e:
+            raise IngestError('Error processing data', str(e))
+        except Exception as e:
+            raise IngestError('Error inserting data into database', str(e))
+    finally:
+        if reader is not None:
+            reader.close()
+
+    # An append leaves the table matching no single upload
+    if digest and load_mode != 'append':
+        LoadedTable.objects.update_or_create(
+            **target, defaults={'digest': digest, 'load_mode': load_mode, 'key_column': key_column or ''}
+        )
+    else:
+        LoadedTable.objects.filter(**target).delete()
+    return column_details, {phase: round(seconds, 3) for phase, seconds in timings.items()}
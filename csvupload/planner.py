@@ -0,0 +1,237 @@
+import re
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from .ingest import SCHEMA_KIND_DTYPES, map_dtype_to_mysql
+
+# Most distinct values a text column may have to be declared as an ENUM; 0 disables ENUMs
+ENUM_MAX_VALUES = getattr(settings, 'CSVUPLOAD_ENUM_MAX_VALUES', 16)
+
+# Longest text, in characters, kept in a VARCHAR; longer columns become a TEXT type
+VARCHAR_MAX_LENGTH = getattr(settings, 'CSVUPLOAD_VARCHAR_MAX_LENGTH', 1024)
+
+# Most digits after the point a float column may need to be stored as DECIMAL instead of DOUBLE
+DECIMAL_MAX_SCALE = getattr(settings, 'CSVUPLOAD_DECIMAL_MAX_SCALE', 10)
+
+DECIMAL_MAX_PRECISION = 65
+
+# Row size limit; VARCHARs count as 4 bytes per character in utf8mb4 plus a length prefix,
+# and every other column is given a generous fixed share
+MYSQL_ROW_BYTES = 65535
+
+MYSQL_COLUMN_BYTES = 32
+
+INTEGER_TYPES = [
+    ('TINYINT', 2 ** 7),
+    ('SMALLINT', 2 ** 15),
+    ('MEDIUMINT', 2 ** 23),
+    ('INT', 2 ** 31),
+    ('BIGINT', 2 ** 63),
+]
+
+TEXT_TYPES = [
+    ('TEXT', 2 ** 16 - 1),
+    ('MEDIUMTEXT', 2 ** 24 - 1),
+    ('LONGTEXT', 2 ** 32 - 1),
+]
+
+def _decimal_scale(values):
+    values = values[np.isfinite(values)]
+    for scale in range(DECIMAL_MAX_SCALE + 1):
+        values = values[np.round(values, scale) != values]
+        if not values.size:
+            return scale
+    return None
+
+# Per-column statistics over every typed chunk of an upload, kept JSON serializable so
+# they can be staged in the manifest next to the typed data
+class TableStats:
+    def __init__(self, schema):
+        self.schema = schema
+        self.columns = {}
+        for col, spec in schema.items():
+            self.columns[col] = {'rows': 0, 'nulls': 0, 'min': None, 'max': None, 'scale': 0, 'has_time': False,
+                                 'max_length': 0, 'max_bytes': 0, 'values': []}
+
+    # `raw` is the chunk as read, before apply_schema downcast its numbers
+    def update(self, raw, typed):
+        for col, spec in self.schema.items():
+            stats = self.columns[col]
+            series = typed[col]
+            values = series.dropna()
+            stats['rows'] += len(series)
+            stats['nulls'] += len(series) - len(values)
+            if values.empty:
+                continue
+
+            kind = spec['kind']
+            if kind in ('integer', 'float'):
+                low, high = values.min().item(), values.max().item()
+                stats['min'] = low if stats['min'] is None else min(stats['min'], low)
+                stats['max'] = high if stats['max'] is None else max(stats['max'], high)
+                if kind == 'float' and stats['scale'] is not None:
+                    exact = pd.to_numeric(raw[col], errors='coerce').dropna().to_numpy(dtype='float64')
+                    scale = _decimal_scale(exact)
+                    stats['scale'] = None if scale is None else max(stats['scale'], scale)
+            elif kind == 'date':
+                stats['has_time'] = stats['has_time'] or bool((values != values.dt.normalize()).any())
+            elif kind == 'string':
+                if spec.get('categorical'):
+                    # The categories already are every distinct value seen so far
+                    values = pd.Series(values.cat.categories, dtype='string')
+                stats['max_length'] = max(stats['max_length'], int(values.str.len().max()))
+                stats['max_bytes'] = max(stats['max_bytes'], int(values.str.encode('utf-8').str.len().max()))
+                if stats['values'] is not None:
+                    distinct = set(stats['values']).union(values.unique()[:ENUM_MAX_VALUES + 1])
+                    stats['values'] = sorted(distinct) if len(distinct) <= ENUM_MAX_VALUES else None
+
+    def as_dict(self):
+        return self.columns
+
+def _integer_type(low, high):
+    for name, bound in INTEGER_TYPES:
+        if -bound <= low and high < bound:
+            return name
+    return f'DECIMAL({len(str(int(max(abs(low), abs(high)))))},0)'
+
+def _decimal_type(stats):
+    if stats['scale'] is None:
+        return 'DOUBLE'
+    digits = len(str(int(max(abs(stats['min']), abs(stats['max'])))))
+    precision = max(digits + stats['scale'], 1)
+    if precision > DECIMAL_MAX_PRECISION:
+        return 'DOUBLE'
+    return f"DECIMAL({precision},{stats['scale']})"
+
+def _string_literal(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+# ENUM members compare case-insensitively and ignore trailing spaces, and '' is reserved
+# for invalid values; any clash under those rules keeps the column as text
+def _enum_type(values):
+    folded = {value.rstrip().casefold() for value in values}
+    if '' in folded or len(folded) != len(values):
+        return None
+    return 'ENUM(' + ', '.join(_string_literal(value) for value in values) + ')'
+
+def _text_type(stats, allow_enum):
+    if allow_enum and stats['values']:
+        enum = _enum_type(stats['values'])
+        if enum:
+            return enum
+    if stats['max_length'] <= VARCHAR_MAX_LENGTH:
+        return f"VARCHAR({max(stats['max_length'], 1)})"
+    return next(name for name, limit in TEXT_TYPES if stats['max_bytes'] <= limit)
+
+def _mysql_type(spec, stats, allow_enum):
+    kind = spec['kind']
+    if stats is None or stats['rows'] == stats['nulls']:
+        return map_dtype_to_mysql(pd.api.types.pandas_dtype(SCHEMA_KIND_DTYPES[kind]))
+    if kind == 'integer':
+        return _integer_type(stats['min'], stats['max'])
+    elif kind == 'float':
+        return _decimal_type(stats)
+    elif kind == 'boolean':
+        return 'BOOLEAN'
+    elif kind == 'date':
+        return 'DATETIME' if stats['has_time'] else 'DATE'
+    return _text_type(stats, allow_enum)
+
+# The most compact exact MySQL type for every column, given statistics over all of its
+# values. Without statistics each kind falls back to a type wide enough for any value.
+# ENUMs are only chosen when `allow_enum`, i.e. when no later load can bring new values.
+def plan_mysql_types(schema, stats=None, allow_enum=False):
+    stats = stats or {}
+    types = {col: _mysql_type(spec, stats.get(col), allow_enum) for col, spec in schema.items()}
+
+    # Move the longest VARCHARs out of the row until the row fits
+    varchars = sorted(
+        (col for col, column_type in types.items() if column_type.startswith('VARCHAR(')),
+        key=lambda col: stats[col]['max_length']
+    )
+    row_bytes = sum(stats[col]['max_length'] * 4 + 2 for col in varchars)
+    row_bytes += MYSQL_COLUMN_BYTES * (len(types) - len(varchars))
+    while varchars and row_bytes > MYSQL_ROW_BYTES:
+        col = varchars.pop()
+        row_bytes -= stats[col]['max_length'] * 4 + 2 - MYSQL_COLUMN_BYTES
+        types[col] = next(name for name, limit in TEXT_TYPES if stats[col]['max_bytes'] <= limit)
+    return types
+
+# Characters a value of each non-text column type takes when written out as text
+TEXT_WIDTHS = {'double': 24, 'date': 10, 'datetime': 19}
+
+# A MySQL column type, as declared by plan_mysql_types or as information_schema reports it,
+# reduced to what decides which values it holds; None for types this module never declares
+def _describe_type(column_type):
+    column_type = column_type.strip().upper()
+    match = re.match(r'(\w+)(?:\((.*)\))?\s*(UNSIGNED)?', column_type)
+    name, args, unsigned = match.groups()
+    if unsigned:
+        return None
+    if name in ('BOOLEAN', 'BOOL'):
+        name = 'TINYINT'
+    bounds = dict(INTEGER_TYPES, INTEGER=2 ** 31)
+    if name in bounds:
+        return {'family': 'integer', 'bound': bounds[name], 'digits': len(str(bounds[name] - 1)), 'scale': 0}
+    elif name in ('DECIMAL', 'NUMERIC'):
+        precision, _, scale = (args or '10,0').partition(',')
+        scale = int(scale or 0)
+        return {'family': 'decimal', 'digits': int(precision) - scale, 'scale': scale}
+    elif name in ('DOUBLE', 'FLOAT', 'REAL'):
+        return {'family': 'double'}
+    elif name in ('DATE', 'DATETIME', 'TIMESTAMP'):
+        return {'family': 'date', 'has_time': name != 'DATE'}
+    elif name in ('CHAR', 'VARCHAR'):
+        return {'family': 'text', 'bytes': int(args) * 4, 'name': f'VARCHAR({args})'}
+    elif name == 'ENUM':
+        members = re.findall(r"'((?:[^']|'')*)'", args)
+        return {'family': 'enum', 'bytes': max((len(value) for value in members), default=1) * 4}
+    limits = dict(TEXT_TYPES, TINYTEXT=255)
+    if name in limits:
+        return {'family': 'text', 'bytes': limits[name], 'name': name}
+    return None
+
+def _text_bytes(described):
+    family = described['family']
+    if family in ('text', 'enum'):
+        return described['bytes']
+    elif family in ('integer', 'decimal'):
+        # Sign and decimal point
+        return (described['digits'] + described['scale'] + 2) * 4
+    elif family == 'date':
+        return TEXT_WIDTHS['datetime' if described['has_time'] else 'date'] * 4
+    return TEXT_WIDTHS[family] * 4
+
+def _text_type_for(size):
+    if size <= VARCHAR_MAX_LENGTH * 4:
+        return f'VARCHAR({max(-(-size // 4), 1)})'
+    return next(name for name, limit in TEXT_TYPES if size <= limit)
+
+# The type an existing `current` column must be altered to so it also holds the values a
+# `planned` column would, or None when it already does. Integers and decimals widen to a
+# decimal holding both, dates to DATETIME, and columns of different kinds to text.
+def widen_mysql_type(current, planned):
+    old, new = _describe_type(current), _describe_type(planned)
+    if old is None or new is None or current.strip().upper() == planned.strip().upper():
+        return None
+    numeric = ('integer', 'decimal', 'double')
+    if old['family'] in numeric and new['family'] in numeric:
+        if old['family'] == 'double':
+            return None
+        elif new['family'] == 'double':
+            return 'DOUBLE'
+        elif old['family'] == new['family'] == 'integer':
+            return None if old['bound'] >= new['bound'] else planned
+        digits, scale = max(old['digits'], new['digits']), max(old['scale'], new['scale'])
+        if (digits, scale) == (old['digits'], old['scale']):
+            return None
+        return f'DECIMAL({digits + scale},{scale})' if digits + scale <= DECIMAL_MAX_PRECISION else 'DOUBLE'
+    elif old['family'] == new['family'] == 'date':
+        return 'DATETIME' if new['has_time'] and not old['has_time'] else None
+    elif old['family'] == 'text' and old['bytes'] >= _text_bytes(new):
+        return None
+    # An ENUM takes no values beyond its members, so any other type makes it text
+    size = max(_text_bytes(old), _text_bytes(new))
+    if old['family'] == 'text' and new['family'] == 'text':
+        return max((old, new), key=lambda described: described['bytes'])['name']
+    return _text_type_for(size)
@@ -0,0 +1,366 @@
+import io
+import os
+import sqlite3
+import uuid
+from contextlib import closing, contextmanager, nullcontext
+import pandas as pd
+import pymysql
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .ingest import schema_dtypes
+from .loaders import quote_identifier, insert_rows, load_data_infile, clean_data_for_mysql, write_tsv
+from .connections import get_pool
+from .planner import TEXT_TYPES, plan_mysql_types, widen_mysql_type
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# Directory that SQLite targets are created in; the `database` field names a file inside it
+SQLITE_ROOT = getattr(settings, 'CSVUPLOAD_SQLITE_ROOT', os.path.join(settings.BASE_DIR, 'sqlite'))
+
+# DataBaseType used when the request does not name one
+DEFAULT_DATABASE_TYPE = getattr(settings, 'CSVUPLOAD_DEFAULT_DATABASE_TYPE', 'mysql')
+
+# Build indexes after the data is in and, on MySQL, load with unique and foreign key checks off
+FAST_LOAD = getattr(settings, 'CSVUPLOAD_FAST_LOAD', False)
+
+# Upper bound on one multi-row INSERT during a MySQL fast load; the server's
+# max_allowed_packet caps it further
+FAST_LOAD_STATEMENT_BYTES = getattr(settings, 'CSVUPLOAD_FAST_LOAD_STATEMENT_BYTES', 16 * 1024 * 1024)
+
+# Leading characters of TEXT and long VARCHAR values a MySQL index covers; InnoDB keys are
+# at most 3072 bytes, 4 per utf8mb4 character
+MYSQL_INDEX_PREFIX_LENGTH = getattr(settings, 'CSVUPLOAD_MYSQL_INDEX_PREFIX_LENGTH', 255)
+
+# A target database: how to connect, which column types to declare and how to bulk load.
+# Each backend loads through the fastest path its engine offers.
+class Sink:
+    database_type = None
+    database_errors = ()
+    required_fields = ('host', 'user', 'password', 'database')
+    # DB-API placeholder; with 'format' style drivers literal % in statements is doubled
+    placeholder = '%s'
+    # Rows per DELETE ... WHERE key IN (...) statement
+    delete_batch_rows = 1000
+
+    def __init__(self, insert_method='insert', fast_load=False):
+        self.insert_method = insert_method
+        self.fast_load = fast_load
+
+    def column_type(self, dtype):
+        raise NotImplementedError
+
+    # Column types for the schema; `stats` (see planner.TableStats) lets a sink pick tighter
+    # types and `allow_enum` says no later load will add values to the table
+    def column_types(self, schema, stats=None, allow_enum=False):
+        return {col: self.column_type(dtype) for col, dtype in schema_dtypes(schema).items()}
+
+    def quote_identifier(self, name):
+        return '"' + str(name).replace('"', '""') + '"'
+
+    def connect(self, connection_details):
+        raise NotImplementedError
+
+    def param_identifier(self, name):
+        quoted = self.quote_identifier(name)
+        return quoted.replace('%', '%%') if self.placeholder == '%s' else quoted
+
+    # Drop and recreate the table, or with replace=False create it only if it is missing
+    def create_table(self, cursor, table_name, column_types, replace=True):
+        table = self.quote_identifier(table_name)
+        columns = ', '.join(f"{self.quote_identifier(col)} {column_types[col]}" for col in column_types)
+        if replace:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"CREATE TABLE {table} ({columns})")
+        else:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+
+    def load(self, cursor, table_name, data):
+        raise NotImplementedError
+
+    # Session settings held for the whole load; nothing to change by default
+    def bulk_session(self, connection, cursor):
+        return nullcontext()
+
+    # Alter the columns of an existing table that cannot hold values of `column_types`;
+    # engines whose declared types never narrow have nothing to do
+    def widen_columns(self, cursor, table_name, column_types):
+        pass
+
+    # What CREATE INDEX lists for `col`, declared as `column_type`
+    def index_key(self, col, column_type):
+        return self.quote_identifier(col)
+
+    def create_indexes(self, cursor, table_name, columns, column_types):
+        table = self.quote_identifier(table_name)
+        for col in columns:
+            # Index names are schema wide on some engines and must survive a staging table rename
+            name = self.quote_identifier(f'ix_{uuid.uuid4().hex[:16]}')
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({self.index_key(col, column_types[col])})")
+
+    def delete_all(self, cursor, table_name):
+        cursor.execute(f"DELETE FROM {self.quote_identifier(table_name)}")
+
+    # Expression comparing a text column byte for byte, or None when the column's own
+    # comparison already does
+    def exact_key(self, column):
+        return None
+
+    # Distinct non-NULL values of `key_column` in the table; `text` keys count as distinct
+    # whenever they differ at all
+    def count_keys(self, cursor, table_name, key_column, text=False):
+        column = self.quote_identifier(key_column)
+        column = (text and self.exact_key(column)) or column
+        cursor.execute(f"SELECT COUNT(DISTINCT {column}) AS key_count FROM {self.quote_identifier(table_name)}")
+        row = cursor.fetchone()
+        # MySQL rows come back as dicts
+        return row['key_count'] if isinstance(row, dict) else row[0]
+
+    # Delete every row whose `key_column` is exactly one of `keys` (a Series)
+    def delete_keys(self, cursor, table_name, key_column, keys):
+        keys = keys.dropna().drop_duplicates()
+        text = pd.api.types.is_string_dtype(keys) or isinstance(keys.dtype, pd.CategoricalDtype)
+        if pd.api.types.is_datetime64_any_dtype(keys):
+            keys = keys.dt.strftime('%Y-%m-%d %H:%M:%S')
+        keys = keys.tolist()
+        table = self.param_identifier(table_name)
+        column = self.param_identifier(key_column)
+        exact = text and self.exact_key(column)
+        for start in range(0, len(keys), self.delete_batch_rows):
+            batch = keys[start:start + self.delete_batch_rows]
+            placeholders = ', '.join([self.placeholder] * len(batch))
+            if exact:
+                # The column's index narrows the rows, the exact comparison picks them
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE {column} IN ({placeholders}) AND {exact} IN ({placeholders})", batch * 2
+                )
+            else:
+                cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", batch)
+
+    def table_exists(self, cursor, table_name):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = current_schema() AND table_name = %s",
+            (table_name,)
+        )
+        return cursor.fetchone() is not None
+
+    def begin(self, cursor):
+        pass
+
+    # Put a fully loaded staging table in place of `table_name` in one transaction
+    # (DDL is transactional here), then commit
+    def swap_tables(self, connection, cursor, staging_name, table_name):
+        table = self.quote_identifier(table_name)
+        old = self.quote_identifier(f'{table_name}__old')
+        self.begin(cursor)
+        cursor.execute(f"DROP TABLE IF EXISTS {old}")
+        if self.table_exists(cursor, table_name):
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+        cursor.execute(f"ALTER TABLE {self.quote_identifier(staging_name)} RENAME TO {table}")
+        cursor.execute(f"DROP TABLE IF EXISTS {old}")
+        connection.commit()
+
+class MySQLSink(Sink):
+    database_type = 'mysql'
+    database_errors = (pymysql.MySQLError,)
+
+    def column_types(self, schema, stats=None, allow_enum=False):
+        return plan_mysql_types(schema, stats, allow_enum)
+
+    def quote_identifier(self, name):
+        return quote_identifier(name)
+
+    def connect(self, connection_details):
+        return get_pool().connection(
+            **connection_details,
+            cursorclass=pymysql.cursors.DictCursor,
+            local_infile=self.insert_method == 'load_data'
+        )
+
+    def load(self, cursor, table_name, data):
+        if self.insert_method == 'load_data':
+            load_data_infile(cursor, table_name, data)
+        else:
+            insert_rows(cursor, table_name, data)
+
+    # Relax per-row checks and send bigger INSERT statements for the duration of a fast load.
+    # The previous session state is put back afterwards because the connection returns to
+    # the pool; if the load fails the pool closes the connection instead.
+    @contextmanager
+    def bulk_session(self, connection, cursor):
+        if not self.fast_load:
+            yield
+            return
+        cursor.execute(
+            "SELECT @@SESSION.unique_checks AS unique_checks, @@SESSION.foreign_key_checks AS foreign_key_checks, "
+            "@@SESSION.max_allowed_packet AS max_allowed_packet"
+        )
+        session = cursor.fetchone()
+        autocommit = connection.get_autocommit()
+        max_stmt_length = cursor.max_stmt_length
+
+        cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+        connection.autocommit(False)
+        # pymysql splits executemany() batches into statements of at most this many bytes
+        cursor.max_stmt_length = max(max_stmt_length, min(FAST_LOAD_STATEMENT_BYTES, int(session['max_allowed_packet']) - 1024))
+        yield
+
+        cursor.max_stmt_length = max_stmt_length
+        cursor.execute(
+            "SET SESSION unique_checks = %s, foreign_key_checks = %s",
+            (session['unique_checks'], session['foreign_key_checks'])
+        )
+        connection.autocommit(autocommit)
+
+    def table_exists(self, cursor, table_name):
+        cursor.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+            (table_name,)
+        )
+        return cursor.fetchone() is not None
+
+    def widen_columns(self, cursor, table_name, column_types):
+        cursor.execute(
+            "SELECT column_name AS name, column_type AS type FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = %s",
+            (table_name,)
+        )
+        current = {row['name']: row['type'] for row in cursor.fetchall()}
+        widened = {col: widen_mysql_type(current[col], column_type)
+                   for col, column_type in column_types.items() if col in current}
+        widened = {col: column_type for col, column_type in widened.items() if column_type}
+        if widened:
+            changes = ', '.join(f"MODIFY {self.quote_identifier(col)} {column_type}" for col, column_type in widened.items())
+            cursor.execute(f"ALTER TABLE {self.quote_identifier(table_name)} {changes}")
+
+    # Collations like utf8mb4_0900_ai_ci ignore case, accents and trailing spaces, so 'abc'
+    # and 'ABC ' are the same key to `=` and IN; the bytes are not
+    def exact_key(self, column):
+        return f"CAST({column} AS BINARY)"
+
+    # TEXT columns can only be indexed on a prefix, and so can VARCHARs longer than a key
+    def index_key(self, col, column_type):
+        key = self.quote_identifier(col)
+        name, _, length = column_type.upper().rstrip(')').partition('(')
+        if name in dict(TEXT_TYPES) or (name == 'VARCHAR' and int(length) > MYSQL_INDEX_PREFIX_LENGTH):
+            return f'{key}({MYSQL_INDEX_PREFIX_LENGTH})'
+        return key
+
+    # MySQL DDL commits implicitly, but a multi-table RENAME TABLE is itself atomic
+    def swap_tables(self, connection, cursor, staging_name, table_name):
+        table = self.quote_identifier(table_name)
+        staging = self.quote_identifier(staging_name)
+        old = self.quote_identifier(f'{table_name}__old')
+        cursor.execute(f"DROP TABLE IF EXISTS {old}")
+        if self.table_exists(cursor, table_name):
+            cursor.execute(f"RENAME TABLE {table} TO {old}, {staging} TO {table}")
+            cursor.execute(f"DROP TABLE {old}")
+        else:
+            cursor.execute(f"RENAME TABLE {staging} TO {table}")
+        connection.commit()
+
+class PostgreSQLSink(Sink):
+    database_type = 'postgresql'
+    database_errors = (psycopg2.Error,) if psycopg2 else ()
+
+    def __init__(self, insert_method='insert', fast_load=False):
+        if psycopg2 is None:
+            raise ImproperlyConfigured('PostgreSQL uploads require the psycopg2 package')
+        super().__init__(insert_method, fast_load)
+
+    def column_type(self, dtype):
+        if pd.api.types.is_bool_dtype(dtype):
+            return 'BOOLEAN'
+        elif pd.api.types.is_integer_dtype(dtype):
+            return 'BIGINT'
+        elif pd.api.types.is_float_dtype(dtype):
+            return 'DOUBLE PRECISION'
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            return 'TIMESTAMP'
+        return 'TEXT'
+
+    @contextmanager
+    def connect(self, connection_details):
+        details = {key: value for key, value in connection_details.items() if value is not None}
+        details['dbname'] = details.pop('database')
+        connection = psycopg2.connect(**details)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    # COPY's text format is the same tab separated, backslash escaped, \N for NULL layout
+    # that LOAD DATA reads, so the chunk is serialized once and streamed in
+    def load(self, cursor, table_name, data):
+        if data.empty:
+            return
+        buffer = io.StringIO()
+        write_tsv(data, buffer)
+        buffer.seek(0)
+        columns = ', '.join(self.quote_identifier(col) for col in data.columns)
+        cursor.copy_expert(f"COPY {self.quote_identifier(table_name)} ({columns}) FROM STDIN", buffer)
+
+class SQLiteSink(Sink):
+    database_type = 'sqlite'
+    database_errors = (sqlite3.Error,)
+    required_fields = ('database',)
+    placeholder = '?'
+    # Stays under SQLite's default limit on bound parameters per statement
+    delete_batch_rows = 900
+
+    def column_type(self, dtype):
+        if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+            return 'INTEGER'
+        elif pd.api.types.is_float_dtype(dtype):
+            return 'REAL'
+        return 'TEXT'
+
+    @contextmanager
+    def connect(self, connection_details):
+        os.makedirs(SQLITE_ROOT, exist_ok=True)
+        path = os.path.join(SQLITE_ROOT, os.path.basename(connection_details['database']))
+        # Autocommit off at the driver level: the whole load is one transaction
+        connection = sqlite3.connect(path, isolation_level='DEFERRED')
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def load(self, cursor, table_name, data):
+        # sqlite3 has no adapter for pandas timestamps; store them as ISO text
+        data = data.assign(**{
+            col: data[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+            for col in data.columns if pd.api.types.is_datetime64_any_dtype(data[col])
+        })
+        columns = ', '.join(self.quote_identifier(col) for col in data.columns)
+        placeholders = ', '.join(['?'] * len(data.columns))
+        cursor.executemany(
+            f"INSERT INTO {self.quote_identifier(table_name)} ({columns}) VALUES ({placeholders})",
+            clean_data_for_mysql(data)
+        )
+
+    def table_exists(self, cursor, table_name):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        return cursor.fetchone() is not None
+
+    # The sqlite3 module does not open transactions for DDL on its own
+    def begin(self, cursor):
+        cursor.execute('BEGIN')
+
+SINKS = {
+    'mysql': MySQLSink,
+    'postgresql': PostgreSQLSink,
+    'postgres': PostgreSQLSink,
+    'sqlite': SQLiteSink,
+}
+
+def get_sink(database_type=None, insert_method='insert', fast_load=False):
+    key = (database_type or DEFAULT_DATABASE_TYPE).strip().lower()
+    if key not in SINKS:
+        raise ValueError(f"DataBaseType must be one of {', '.join(sorted(SINKS))}")
+    return SINKS[key](insert_method, fast_load)
+
+def open_cursor(connection):
+    return closing(connection.cursor())
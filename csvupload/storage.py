@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import pandas as pd
+from django.conf import settings
+from .ingest import (
+    CATEGORY_MAX_RATIO, CATEGORY_MAX_VALUES, CHUNK_ROWS, DATE_FORMAT_MIN_RATIO, DATE_FORMAT_SAMPLE_VALUES, DATE_SAMPLE_VALUES,
+    KNOWN_DATE_FORMATS, MIXED_TYPE_SAMPLE_VALUES, SAMPLE_ROWS, upload_suffix,
+)
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+UPLOADS_PATH = os.path.join(settings.MEDIA_ROOT, 'uploads')
+
+# Keep the typed chunks of every parsed upload so identical re-uploads skip parsing
+TYPED_CACHE = getattr(settings, 'CSVUPLOAD_TYPED_CACHE', True)
+
+# Compression of the Arrow IPC staging file: 'zstd', 'lz4' or None. Uncompressed
+# files are memory-mapped with zero copy; compressed ones trade that for disk space,
+# decompressing only the columns a reader asks for.
+STAGING_COMPRESSION = getattr(settings, 'CSVUPLOAD_STAGING_COMPRESSION', 'zstd')
+
+# Bumped whenever the typed output for the same bytes may change
+TYPED_CACHE_VERSION = 8
+
+# Write the upload under its SHA-256, hashing while it streams to disk.
+# Identical bytes always end up in the same file, which is kept only once.
+def save_upload(uploaded_file):
+    os.makedirs(UPLOADS_PATH, exist_ok=True)
+    fd, part_path = tempfile.mkstemp(dir=UPLOADS_PATH, suffix='.part')
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for block in uploaded_file.chunks():
+                digest.update(block)
+                out.write(block)
+    except BaseException:
+        os.remove(part_path)
+        raise
+
+    digest = digest.hexdigest()
+    return digest, keep_upload(part_path, digest, upload_suffix(uploaded_file.name) or '.csv')
+
+# Move a fully written upload into place under its digest, returning its path. The suffix
+# is kept so compressed uploads are decompressed when read.
+def keep_upload(part_path, digest, suffix='.csv'):
+    filepath = os.path.join(UPLOADS_PATH, f'{digest}{suffix}')
+    if os.path.exists(filepath):
+        os.remove(part_path)
+    else:
+        os.replace(part_path, filepath)
+    return filepath
+
+# Everything besides the bytes that decides the typed result: a staged copy made under any
+# other value of these settings is parsed again
+def _cache_fingerprint():
+    return {
+        'version': TYPED_CACHE_VERSION,
+        'format': 'arrow' if pa else 'pickle',
+        'sample_rows': SAMPLE_ROWS,
+        'chunk_rows': CHUNK_ROWS,
+        'category_max_values': CATEGORY_MAX_VALUES,
+        'category_max_ratio': CATEGORY_MAX_RATIO,
+        'mixed_type_sample_values': MIXED_TYPE_SAMPLE_VALUES,
+        'date_sample_values': DATE_SAMPLE_VALUES,
+        'date_format_sample_values': DATE_FORMAT_SAMPLE_VALUES,
+        'date_format_min_ratio': DATE_FORMAT_MIN_RATIO,
+        'known_date_formats': KNOWN_DATE_FORMATS,
+    }
+
+def _arrow_schema(schema):
+    arrow_types = {
+        'date': pa.timestamp('ns'),
+        'integer': pa.int64(),
+        'float': pa.float64(),
+        'boolean': pa.bool_(),
+        'string': pa.string(),
+    }
+    # Categorical columns are dictionary encoded; each batch only adds to the dictionary
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        (col, dictionary if spec.get('categorical') else arrow_types[spec['kind']]) for col, spec in schema.items()
+    ])
+
+# Read Arrow columns back into the nullable pandas dtypes apply_schema produces
+_PANDAS_TYPES = {}
+if pa:
+    _PANDAS_TYPES = {pa.string(): pd.StringDtype(), pa.bool_(): pd.BooleanDtype(), pa.int64(): pd.Int64Dtype()}
+
+# Typed result of parsing one upload, staged next to it as <sha256>.typed/: the schema in
+# manifest.json and the data as one Arrow IPC file with a record batch per typed chunk.
+# Without pyarrow the chunks are kept as pickles instead.
+class StagedUpload:
+    def __init__(self, digest):
+        self.path = os.path.join(UPLOADS_PATH, f'{digest}.typed')
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+        self.data_path = os.path.join(self.path, 'data.arrow')
+        self._manifest = None
+
+    # The schema, or None when nothing usable is staged for these bytes
+    def load_schema(self):
+        if not TYPED_CACHE:
+            return None
+        try:
+            with open(self.manifest_path, encoding='utf-8') as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('fingerprint') != _cache_fingerprint():
+            return None
+        self._manifest = manifest
+        return manifest['schema']
+
+    # Column statistics gathered while the upload was parsed (see planner.TableStats)
+    def load_stats(self):
+        if self._manifest is None and self.load_schema() is None:
+            return None
+        return self._manifest.get('stats')
+
+    # Yield (rows read, typed chunk) pairs exactly as iter_typed_chunks did when parsing.
+    # `columns` limits what is read; other columns are never touched on disk.
+    def iter_chunks(self, columns=None):
+        if self._manifest is None and self.load_schema() is None:
+            return
+        chunks = self._manifest['chunks']
+        if self._manifest['fingerprint']['format'] == 'pickle':
+            for entry in chunks:
+                data = pd.read_pickle(os.path.join(self.path, entry['file']))
+                yield entry['rows_read'], data[columns] if columns else data
+            return
+
+        options = None
+        if columns:
+            # Only these fields are read, and decompressed, from each batch
+            fields = list(self._manifest['schema'])
+            options = pa.ipc.IpcReadOptions(included_fields=sorted(fields.index(col) for col in columns))
+        with pa.memory_map(self.data_path) as source:
+            reader = pa.ipc.open_file(source, options=options)
+            for index, entry in enumerate(chunks):
+                batch = reader.get_batch(index)
+                if columns:
+                    batch = batch.select(columns)
+                yield entry['rows_read'], batch.to_pandas(types_mapper=_PANDAS_TYPES.get)
+
+    # Stage typed chunks as they pass through; the staged copy only appears after the
+    # last chunk, so an interrupted parse never leaves a partial result behind.
+    # `stats` is read once the chunks are exhausted and saved alongside the schema.
+    def record(self, schema, typed_chunks, stats=None):
+        if not TYPED_CACHE:
+            yield from typed_chunks
+            return
+
+        work_path = tempfile.mkdtemp(dir=UPLOADS_PATH, suffix='.typed.part')
+        writer = None
+        try:
+            chunks = []
+            if pa:
+                arrow_schema = _arrow_schema(schema)
+                options = pa.ipc.IpcWriteOptions(compression=STAGING_COMPRESSION, emit_dictionary_deltas=True)
+                writer = pa.ipc.new_file(os.path.join(work_path, 'data.arrow'), arrow_schema, options=options)
+            for rows_read, data in typed_chunks:
+                if writer is not None:
+                    # Exactly one record batch per chunk, even an empty one
+                    writer.write_batch(pa.RecordBatch.from_pandas(data, schema=arrow_schema, preserve_index=False))
+                    chunks.append({'rows_read': rows_read})
+                else:
+                    name = f'chunk-{len(chunks):05d}.pkl'
+                    data.to_pickle(os.path.join(work_path, name))
+                    chunks.append({'file': name, 'rows_read': rows_read})
+                yield rows_read, data
+
+            if writer is not None:
+                writer.close()
+                writer = None
+            with open(os.path.join(work_path, 'manifest.json'), 'w', encoding='utf-8') as fh:
+                json.dump({
+                    'fingerprint': _cache_fingerprint(),
+                    'schema': schema,
+                    'stats': stats.as_dict() if stats else None,
+                    'chunks': chunks,
+                }, fh)
+            # Replace a copy staged under an older fingerprint
+            shutil.rmtree(self.path, ignore_errors=True)
+            try:
+                os.replace(work_path, self.path)
+            except OSError:
+                # Another upload of the same bytes got there first; its copy is equivalent
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
+            shutil.rmtree(work_path, ignore_errors=True)
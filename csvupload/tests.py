@@ -1,3 +1,405 @@
-from django.test import TestCase
+import gzip
+import os
+import shutil
+import sqlite3
+import io
+import tempfile
+import zipfile
+from contextlib import closing
+from unittest import mock, skipUnless
+import pandas as pd
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from .ingest import _zip_head, classify_column, decompress_head, infer_schema, iter_typed_chunks
+from .loaders import write_tsv
+from .parsers import open_chunk_reader
+from .pipeline import ingest_csv
+from .planner import TableStats, plan_mysql_types, widen_mysql_type
+from .sinks import MySQLSink
+from .storage import StagedUpload
 
-# Create your tests here.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def write_csv(directory, name, lines):
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write('\n'.join(lines) + '\n')
+    return path
+
+# Parse `path` the way ingest_csv does, with a `sample_rows` sample and `chunk_rows` chunks
+def read_typed(path, engine='pandas', sample_rows=4, chunk_rows=3):
+    reader = open_chunk_reader(path, engine, chunk_rows)
+    try:
+        sample = reader.read_sample(sample_rows)
+        schema = infer_schema(sample)
+        data = pd.concat([typed for _, typed in iter_typed_chunks(sample, reader, schema)])
+    finally:
+        reader.close()
+    return schema, data
+
+class ChunkTypingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_text_columns_keep_their_text_after_the_sample(self):
+        lines = ['id,code,amount'] + [f'{i},A{i},{i}.5' for i in range(4)] + ['4,00123,1.5', '5,01.50,2.5', '6,00777,3.5']
+        path = write_csv(self.directory, 'codes.csv', lines)
+        schema, data = read_typed(path)
+        self.assertEqual(schema['code']['kind'], 'string')
+        self.assertEqual(data['code'].tolist(), ['A0', 'A1', 'A2', 'A3', '00123', '01.50', '00777'])
+
+    def test_column_empty_in_the_sample_is_text(self):
+        lines = ['id,note'] + [f'{i},' for i in range(4)] + ['4,hello', '5,world']
+        path = write_csv(self.directory, 'notes.csv', lines)
+        schema, data = read_typed(path)
+        self.assertEqual(schema['note'], {'kind': 'string'})
+        self.assertEqual(data['note'].tolist()[4:], ['hello', 'world'])
+
+    def test_parser_engines_agree(self):
+        lines = ['id,name,amount,flag,day', '1,a,1.5,True,2024-01-01', '', '2,"b, quoted",,False,2024-01-02', '']
+        lines += [f'{i},"line {i}\nsecond line",{i}.25,{i % 2 == 0},2024-02-{i:02d}' for i in range(3, 10)]
+        lines += ['', '10,00123,7,True,2024-03-01']
+        path = write_csv(self.directory, 'engines.csv', lines)
+        pandas_schema, pandas_data = read_typed(path, 'pandas')
+        arrow_schema, arrow_data = read_typed(path, 'pyarrow')
+        self.assertEqual(pandas_schema, arrow_schema)
+        self.assertEqual(arrow_data['id'].tolist(), list(range(1, 11)))
+        pd.testing.assert_frame_equal(pandas_data, arrow_data)
+
+    def test_integers_with_gaps_after_the_sample_write_as_integers(self):
+        lines = ['id,value'] + [f'{i},{i}' for i in range(4)] + ['4,', '5,6']
+        path = write_csv(self.directory, 'gaps.csv', lines)
+        for engine in ('pandas', 'pyarrow'):
+            with self.subTest(engine=engine):
+                _, data = read_typed(path, engine)
+                buffer = io.StringIO()
+                write_tsv(data.iloc[4:], buffer)
+                self.assertEqual(buffer.getvalue(), '4\t\\N\n5\t6\n')
+
+    def test_integers_with_blanks_in_the_sample_stay_exact(self):
+        lines = ['id,value', '1,9007199254740993', '2,', '3,5', '4,7', '5,', '6,9007199254740995']
+        path = write_csv(self.directory, 'ids.csv', lines)
+        for engine in ('pandas', 'pyarrow'):
+            with self.subTest(engine=engine):
+                schema, data = read_typed(path, engine)
+                self.assertEqual(schema['value'], {'kind': 'integer'})
+                self.assertEqual(data['value'].dtype, 'Int64')
+                self.assertEqual(
+                    data['value'].tolist(), [9007199254740993, pd.NA, 5, 7, pd.NA, 9007199254740995]
+                )
+                stats = TableStats(schema)
+                stats.update(data, data)
+                self.assertEqual(plan_mysql_types(schema, stats.as_dict())['value'], 'BIGINT')
+
+class ClassifyColumnTests(SimpleTestCase):
+    def test_dates_need_a_format_that_fits_the_sample(self):
+        self.assertEqual(
+            classify_column(pd.Series(['2024-01-31', '2024-02-29', None])), {'kind': 'date', 'format': '%Y-%m-%d'}
+        )
+        # Six digit PIN codes look like DDMMYY, but only the odd one parses as a date
+        pins = pd.Series([110001, 560034, 400076, 110101, 600028, 700091, 500081, 380015])
+        self.assertEqual(classify_column(pins), {'kind': 'integer'})
+
+CSV_TEXT = b'id,name\n' + b''.join(b'%d,name %d\n' % (i, i) for i in range(2000))
+
+def zip_bytes(names, method=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', method) as archive:
+        for name in names:
+            archive.writestr(name, CSV_TEXT)
+    return buffer.getvalue()
+
+class DecompressHeadTests(SimpleTestCase):
+    def assertInvalid(self, head, compression, message, complete=True):
+        with self.assertRaisesMessage(ValueError, message):
+            decompress_head(head, compression, complete)
+
+    def test_gzip(self):
+        data = gzip.compress(CSV_TEXT)
+        self.assertEqual(decompress_head(data, 'gzip', complete=True), (CSV_TEXT, True))
+        head, complete = decompress_head(data[:200], 'gzip')
+        self.assertFalse(complete)
+        self.assertTrue(head and CSV_TEXT.startswith(head))
+        self.assertInvalid(data[:200], 'gzip', 'Uploaded file is not valid gzip data')
+        self.assertInvalid(b'not gzip at all', 'gzip', 'Uploaded file is not valid gzip data')
+
+    @skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstandard(self):
+        data = zstandard.ZstdCompressor().compress(CSV_TEXT)
+        self.assertEqual(decompress_head(data, 'zstd', complete=True), (CSV_TEXT, True))
+        head, complete = decompress_head(data[:200], 'zstd')
+        self.assertFalse(complete)
+        self.assertTrue(CSV_TEXT.startswith(head))
+        self.assertInvalid(data[:-3], 'zstd', 'Uploaded file is not valid zstandard data')
+        self.assertInvalid(b'not zstandard at all', 'zstd', 'Uploaded file is not valid zstandard data')
+
+    def test_zip(self):
+        data = zip_bytes(['upload.csv'])
+        self.assertEqual(decompress_head(data, 'zip', complete=True), (CSV_TEXT, True))
+        head, complete = decompress_head(data[:300], 'zip')
+        self.assertFalse(complete)
+        self.assertTrue(head and CSV_TEXT.startswith(head))
+        self.assertInvalid(zip_bytes(['a.csv', 'b.csv']), 'zip', 'Zip archives must contain exactly one file')
+        self.assertInvalid(data[:300], 'zip', 'Uploaded file is not a valid zip archive')
+        corrupt = data[:40] + b'\xff' * 100
+        self.assertInvalid(corrupt, 'zip', 'Uploaded file is not a valid zip archive', complete=False)
+
+    def test_zip_head_reads_the_first_member_from_its_local_header(self):
+        stored = zip_bytes(['upload.csv'], zipfile.ZIP_STORED)
+        self.assertTrue(CSV_TEXT.startswith(_zip_head(stored[:300])))
+        self.assertEqual(_zip_head(stored[:20]), b'')
+        with self.assertRaisesMessage(ValueError, 'Uploaded file is not a valid zip archive'):
+            _zip_head(b'x' * 40)
+        with self.assertRaisesMessage(ValueError, 'Zip archives must be unencrypted and stored or deflated'):
+            _zip_head(zip_bytes(['upload.csv'], zipfile.ZIP_BZIP2))
+
+# Loads into SQLite files under a temporary directory, with a 4 row sample and 3 row chunks
+class PipelineTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for target, value in [
+            ('csvupload.sinks.SQLITE_ROOT', self.directory),
+            ('csvupload.storage.UPLOADS_PATH', self.directory),
+            ('csvupload.pipeline.SAMPLE_ROWS', 4),
+            ('csvupload.parsers.CHUNK_ROWS', 3),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ingest(self, lines, table='t', name='upload.csv', **options):
+        path = write_csv(self.directory, name, lines)
+        return ingest_csv(path, table, {'database': 'target.sqlite3'}, database_type='sqlite', **options)
+
+    def query(self, sql):
+        with closing(sqlite3.connect(os.path.join(self.directory, 'target.sqlite3'))) as connection, connection:
+            return connection.execute(sql).fetchall()
+
+class WideningTests(PipelineTestCase):
+    def test_integer_column_widens_to_float_then_text(self):
+        lines = ['id,value'] + [f'{i},{i}' for i in range(4)] + ['4,1.5', '5,7', '6,oops']
+        for engine, digest in [('pandas', None), ('pyarrow', None), ('pandas', 'widening')]:
+            column_details, _ = self.ingest(lines, digest=digest, parser_engine=engine)
+            self.assertEqual(column_details['value'], 'TEXT')
+            self.assertEqual(
+                self.query('SELECT value FROM t ORDER BY id'), [('0',), ('1',), ('2',), ('3',), ('1.5',), ('7',), ('oops',)]
+            )
+
+    def test_integer_column_widens_to_float(self):
+        column_details, _ = self.ingest(['id,value'] + [f'{i},{i}' for i in range(4)] + ['4,1.5'], parser_engine='pyarrow')
+        self.assertEqual(column_details['value'], 'REAL')
+        self.assertEqual(self.query('SELECT value FROM t WHERE id = 4'), [(1.5,)])
+
+    def test_categorical_column_outgrowing_its_dictionary_is_text(self):
+        lines = ['id,code', '1,a', '2,a', '3,b', '4,b'] + [f'{i},c{i}' for i in range(5, 12)]
+        self.ingest(lines, digest='codes')
+        staged = StagedUpload('codes')
+        self.assertEqual(staged.load_schema()['code'], {'kind': 'string'})
+        self.assertNotIn('dictionary', staged.load_stats()['code'])
+        self.assertEqual(self.query('SELECT COUNT(DISTINCT code) FROM t'), [(9,)])
+
+class RoundTripTests(PipelineTestCase):
+    def test_floats_load_as_written(self):
+        self.ingest(['id,amount', '1,0.1', '2,2.675', '3,'])
+        self.assertEqual(self.query('SELECT amount FROM t ORDER BY id'), [(0.1,), (2.675,), (None,)])
+
+    def test_every_kind_round_trips(self):
+        lines = [
+            'id,amount,flag,day,region,note',
+            '1,1.25,True,2024-01-31,North,first row',
+            '2,,False,2024-02-29,South,',
+            '3,-3.5,,,North,"quoted, with comma"',
+            '4,4,True,2024-03-01,,last',
+        ]
+        column_details, _ = self.ingest(lines)
+        self.assertEqual(
+            column_details,
+            {'id': 'INTEGER', 'amount': 'REAL', 'flag': 'INTEGER', 'day': 'TEXT', 'region': 'TEXT', 'note': 'TEXT'},
+        )
+        self.assertEqual(self.query('SELECT * FROM t ORDER BY id'), [
+            (1, 1.25, 1, '2024-01-31 00:00:00', 'North', 'first row'),
+            (2, None, 0, '2024-02-29 00:00:00', 'South', None),
+            (3, -3.5, None, None, 'North', 'quoted, with comma'),
+            (4, 4.0, 1, '2024-03-01 00:00:00', None, 'last'),
+        ])
+
+    def test_large_integers_with_blanks_load_exactly(self):
+        lines = ['id,value', '1,9007199254740993', '2,', '3,5', '4,7', '5,', '6,9007199254740995']
+        for engine in ('pandas', 'pyarrow'):
+            self.ingest(lines, parser_engine=engine)
+            self.assertEqual(
+                self.query('SELECT value FROM t ORDER BY id'),
+                [(9007199254740993,), (None,), (5,), (7,), (None,), (9007199254740995,)],
+            )
+
+    def test_replace_reloads_the_table(self):
+        self.ingest(['id,name', '1,a', '2,b'])
+        self.ingest(['id,name', '3,c'], atomic=True)
+        self.assertEqual(self.query('SELECT * FROM t'), [(3, 'c')])
+        self.assertEqual(self.query("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 't%'"), [('t',)])
+
+class StagingTests(PipelineTestCase):
+    def test_staged_columns_are_read_on_their_own(self):
+        self.ingest(['id,name,amount', '1,a,1.5', '2,b,', '3,c,3.25'], digest='columns')
+        chunks = list(StagedUpload('columns').iter_chunks(['amount', 'id']))
+        self.assertEqual([rows_read for rows_read, _ in chunks], [3])
+        data = chunks[0][1]
+        self.assertEqual(list(data.columns), ['amount', 'id'])
+        self.assertEqual(data['id'].tolist(), [1, 2, 3])
+        self.assertEqual(data['amount'].fillna(0).tolist(), [1.5, 0, 3.25])
+
+    def test_staged_integers_with_gaps_write_as_integers(self):
+        self.ingest(['id,value'] + [f'{i},{i}' for i in range(4)] + ['4,', '5,6'], digest='gaps')
+        buffer = io.StringIO()
+        for _, data in StagedUpload('gaps').iter_chunks():
+            write_tsv(data, buffer)
+        self.assertEqual(buffer.getvalue(), '0\t0\n1\t1\n2\t2\n3\t3\n4\t\\N\n5\t6\n')
+
+    def test_staged_copy_depends_on_typing_settings(self):
+        self.ingest(['id,region', '1,North', '2,North', '3,North', '4,South'], digest='settings')
+        self.assertEqual(StagedUpload('settings').load_schema()['region'], {'kind': 'string', 'categorical': True})
+        for setting, value in [('CATEGORY_MAX_VALUES', 1), ('CATEGORY_MAX_RATIO', 0.1), ('KNOWN_DATE_FORMATS', ['%Y'])]:
+            with mock.patch(f'csvupload.storage.{setting}', value):
+                self.assertIsNone(StagedUpload('settings').load_schema())
+
+class LoadModeTests(PipelineTestCase):
+    first = ['id,name', '1,a', '2,b', '3,c']
+
+    def rows(self):
+        return self.query('SELECT id, name FROM t ORDER BY id')
+
+    def test_replace(self):
+        self.ingest(self.first, digest='v1')
+        self.ingest(['id,name', '4,d'], name='v2.csv', digest='v2')
+        self.assertEqual(self.rows(), [(4, 'd')])
+
+    def test_upsert(self):
+        self.ingest(self.first, digest='v1')
+        self.ingest(['id,name', '2,b', '3,z', '4,d'], name='v2.csv', digest='v2', load_mode='upsert', key_column='id')
+        self.assertEqual(self.rows(), [(1, 'a'), (2, 'b'), (3, 'z'), (4, 'd')])
+
+    def test_diff(self):
+        self.ingest(self.first, digest='v1')
+        self.ingest(['id,name', '1,a', '3,z', '4,d'], name='v2.csv', digest='v2', load_mode='diff', key_column='id')
+        self.assertEqual(self.rows(), [(1, 'a'), (3, 'z'), (4, 'd')])
+
+    def test_upsert_into_a_dropped_table(self):
+        self.ingest(self.first, digest='v1')
+        self.query('DROP TABLE t')
+        self.ingest(['id,name', '1,a', '2,b', '3,z'], name='v2.csv', digest='v2', load_mode='upsert', key_column='id')
+        self.assertEqual(self.rows(), [(1, 'a'), (2, 'b'), (3, 'z')])
+
+    def test_diff_into_a_dropped_table(self):
+        self.ingest(self.first, digest='v1')
+        self.query('DROP TABLE t')
+        self.ingest(['id,name', '1,a', '2,b', '3,z'], name='v2.csv', digest='v2', load_mode='diff', key_column='id')
+        self.assertEqual(self.rows(), [(1, 'a'), (2, 'b'), (3, 'z')])
+
+    def test_diff_into_an_edited_table(self):
+        self.ingest(self.first, digest='v1')
+        self.query('DELETE FROM t WHERE id = 1')
+        self.ingest(['id,name', '1,a', '2,b', '3,z'], name='v2.csv', digest='v2', load_mode='diff', key_column='id')
+        self.assertEqual(self.rows(), [(1, 'a'), (2, 'b'), (3, 'z')])
+
+# Posts uploads through the view, storing them in the same temporary directory
+@override_settings(ROOT_URLCONF='csvupload.urls')
+class UploadViewTests(PipelineTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('csvupload.uploadhandler.UPLOADS_PATH', self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, name, content):
+        return self.client.post(reverse('upload_file'), {
+            'DataBaseType': 'sqlite', 'database': 'target.sqlite3', 'table_name': 't',
+            'file': SimpleUploadedFile(name, content, content_type='text/csv'),
+        })
+
+    # Nothing of a rejected upload is left behind, not even its partial file
+    def assertNothingStored(self):
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_upload_is_loaded(self):
+        response = self.post('upload.csv', b'id,name\n1,a\n2,b\n')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.query('SELECT * FROM t ORDER BY id'), [(1, 'a'), (2, 'b')])
+
+    def test_early_rejections(self):
+        cases = [
+            ('upload.txt', b'id,name\n1,a\n', 'Allowed file types are csv, csv.gz, csv.zst and zip'),
+            ('upload.csv', b'', 'Uploaded file is empty'),
+            ('upload.csv', b'id;name\n1;a\n2;b\n', "File appears to be delimited by ';'; only comma separated files are supported"),
+        ]
+        for name, content, error in cases:
+            with self.subTest(error=error):
+                response = self.post(name, content)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': error})
+                self.assertNothingStored()
+
+    @mock.patch('csvupload.uploadhandler.VALIDATE_BYTES', 16)
+    @mock.patch('csvupload.uploadhandler.MAX_UPLOAD_BYTES', 64)
+    @mock.patch('csvupload.views.MAX_UPLOAD_BYTES', 64)
+    def test_upload_over_the_size_cap_is_stopped(self):
+        lines = ['id,name'] + [f'{i},name {i}' for i in range(20)]
+        response = self.post('upload.csv', '\n'.join(lines).encode())
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json(), {'error': 'Uploaded file is larger than 64 bytes'})
+        self.assertNothingStored()
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100)
+    @mock.patch('csvupload.views.MAX_UPLOAD_BYTES', 64)
+    def test_content_length_over_the_cap_is_refused_unread(self):
+        with mock.patch('csvupload.views.CSVUploadHandler') as handler:
+            response = self.post('upload.csv', b'id,name\n' + b'1,a\n' * 100)
+        self.assertEqual(response.status_code, 413)
+        handler.assert_not_called()
+        self.assertNothingStored()
+
+class MySQLTypeTests(SimpleTestCase):
+    def test_widen_mysql_type(self):
+        cases = [
+            ('tinyint', 'BIGINT', 'BIGINT'),
+            ('bigint', 'TINYINT', None),
+            ('tinyint(1)', 'BOOLEAN', None),
+            ('int', 'DECIMAL(5,2)', 'DECIMAL(12,2)'),
+            ('decimal(5,2)', 'DOUBLE', 'DOUBLE'),
+            ('date', 'DATETIME', 'DATETIME'),
+            ('datetime', 'DATE', None),
+            ('varchar(10)', 'VARCHAR(20)', 'VARCHAR(20)'),
+            ('varchar(30)', 'TEXT', 'TEXT'),
+            ('text', 'VARCHAR(1024)', None),
+            ("enum('a','bb')", 'VARCHAR(1)', 'VARCHAR(2)'),
+            ('int', 'VARCHAR(5)', 'VARCHAR(12)'),
+            ('varchar(30)', 'BIGINT', None),
+        ]
+        for current, planned, widened in cases:
+            with self.subTest(current=current, planned=planned):
+                self.assertEqual(widen_mysql_type(current, planned), widened)
+
+    def test_long_text_is_indexed_on_a_prefix(self):
+        sink = MySQLSink()
+        self.assertEqual(sink.index_key('k', 'VARCHAR(40)'), '`k`')
+        self.assertEqual(sink.index_key('k', 'VARCHAR(1024)'), '`k`(255)')
+        self.assertEqual(sink.index_key('k', 'TEXT'), '`k`(255)')
+
+    def test_text_keys_are_compared_byte_for_byte(self):
+        cursor = mock.Mock()
+        cursor.fetchone.return_value = {'key_count': 2}
+        sink = MySQLSink()
+        self.assertEqual(sink.count_keys(cursor, 't', 'k', text=True), 2)
+        cursor.execute.assert_called_with('SELECT COUNT(DISTINCT CAST(`k` AS BINARY)) AS key_count FROM `t`')
+
+        sink.delete_keys(cursor, 't', 'k', pd.Series(['abc', 'abc', None], dtype=object))
+        cursor.execute.assert_called_with(
+            'DELETE FROM `t` WHERE `k` IN (%s) AND CAST(`k` AS BINARY) IN (%s)', ['abc', 'abc']
+        )
+        sink.delete_keys(cursor, 't', 'k', pd.Series([1, 2]))
+        cursor.execute.assert_called_with('DELETE FROM `t` WHERE `k` IN (%s, %s)', [1, 2])
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from .ingest import UPLOAD_SUFFIXES, UPLOAD_TYPES_ERROR, inspect_csv_head, upload_suffix, zip_members_error
+from .storage import UPLOADS_PATH, keep_upload
+
+# Largest file accepted; None for no limit
+MAX_UPLOAD_BYTES = getattr(settings, 'CSVUPLOAD_MAX_UPLOAD_BYTES', 1024 ** 3)
+
+# Leading bytes of an upload checked for a header row and delimiter before the rest is read
+VALIDATE_BYTES = getattr(settings, 'CSVUPLOAD_VALIDATE_BYTES', 64 * 1024)
+
+# An upload CSVUploadHandler has already stored under its SHA-256
+class StoredUpload(UploadedFile):
+    def __init__(self, filepath, digest, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(open(filepath, 'rb'), name, content_type, size, charset, content_type_extra)
+        self.filepath = filepath
+        self.digest = digest
+
+# Streams the `field_name` file of a request straight into the uploads directory, hashing it
+# on the way; compressed files are stored compressed and only their head is inflated.
+# The upload is stopped as soon as it is over MAX_UPLOAD_BYTES, has a name `accept_name`
+# refuses, or its first VALIDATE_BYTES do not look like a CSV; `error` then holds the
+# (response data, status) to answer with. Other fields go to the next handlers.
+class CSVUploadHandler(FileUploadHandler):
+    def __init__(self, request=None, field_name='file', accept_name=None):
+        super().__init__(request)
+        self.field_name = field_name
+        self.accept_name = accept_name
+        self.error = None
+        self.active = False
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        if field_name != self.field_name:
+            return
+        if self.accept_name and not self.accept_name(file_name):
+            self._reject(UPLOAD_TYPES_ERROR)
+        self.suffix = upload_suffix(file_name) or '.csv'
+        self.compression = UPLOAD_SUFFIXES[self.suffix]
+
+        os.makedirs(UPLOADS_PATH, exist_ok=True)
+        fd, self.part_path = tempfile.mkstemp(dir=UPLOADS_PATH, suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.inspected = False
+        self.active = True
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.size += len(raw_data)
+        if MAX_UPLOAD_BYTES and self.size > MAX_UPLOAD_BYTES:
+            self._reject(f'Uploaded file is larger than {MAX_UPLOAD_BYTES} bytes', status=413)
+        if not self.inspected:
+            self.head += raw_data
+            if len(self.head) >= VALIDATE_BYTES:
+                self._inspect(complete=False)
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if not self.inspected:
+            self._inspect(complete=True)
+        self.file.close()
+        if self.compression == 'zip':
+            message = zip_members_error(self.part_path)
+            if message:
+                self._reject(message)
+        self.active = False
+        digest = self.digest.hexdigest()
+        filepath = keep_upload(self.part_path, digest, self.suffix)
+        return StoredUpload(
+            filepath, digest, self.file_name, self.content_type, file_size, self.charset, self.content_type_extra
+        )
+
+    def upload_interrupted(self):
+        self._discard()
+
+    def _inspect(self, complete):
+        message = inspect_csv_head(self.head, complete, self.compression)
+        self.inspected = True
+        self.head = b''
+        if message:
+            self._reject(message)
+
+    def _reject(self, message, status=400):
+        self.error = {'error': message}, status
+        self._discard()
+        # Stop reading the request body; nothing after this point would be used
+        raise StopUpload(connection_reset=True)
+
+    def _discard(self):
+        if self.active:
+            self.file.close()
+            os.remove(self.part_path)
+            self.active = False
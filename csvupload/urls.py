@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),  # Add the route for file upload
+    path('upload/jobs/<uuid:job_id>/', views.upload_status, name='upload_status'),  # Progress of a queued upload
 ]
\ No newline at end of file
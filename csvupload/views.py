@@ -1,17 +1,27 @@
 import os
-import re
-import pandas as pd
-import pymysql
 from django.conf import settings
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from django.core.files.storage import default_storage
-from django.core.exceptions import SuspiciousFileOperation
-
-UPLOADS_PATH = os.path.join(settings.MEDIA_ROOT, 'uploads')
+from django.core.exceptions import SuspiciousFileOperation, ImproperlyConfigured
+from .ingest import UPLOAD_TYPES_ERROR, upload_suffix
+from .loaders import INSERT_METHOD, INSERT_METHODS
+from .models import UploadJob
+from .parsers import PARSER_ENGINE, PARSER_ENGINES, pa
+from .pipeline import IngestError, ingest_csv
+from .jobs import submit_upload_job
+from .incremental import LOAD_MODE, LOAD_MODES, KEYED_LOAD_MODES, ATOMIC_REPLACE
+from .sinks import FAST_LOAD, get_sink
+from .storage import save_upload
+from .uploadhandler import MAX_UPLOAD_BYTES, CSVUploadHandler, StoredUpload
+
+# 'sync' loads inside the request, 'job' queues the load and returns a job id
+UPLOAD_MODE = getattr(settings, 'CSVUPLOAD_UPLOAD_MODE', 'sync')
+
+UPLOAD_MODES = {'sync', 'job'}
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'csv'}
+    return upload_suffix(filename) is not None
 
 def sanitize_filename(filename):
     # Use os.path.basename to get the base filename, which strips out any directory information
@@ -23,95 +33,69 @@ def sanitize_filename(filename):
     
     return basename
 
-def map_dtype_to_mysql(dtype):
-    if pd.api.types.is_integer_dtype(dtype):
-        return 'INT'
-    elif pd.api.types.is_float_dtype(dtype):
-        return 'FLOAT'
-    elif pd.api.types.is_bool_dtype(dtype):
-        return 'BOOLEAN'
-    elif pd.api.types.is_string_dtype(dtype):
-        return 'VARCHAR(255)'
-    elif pd.api.types.is_datetime64_any_dtype(dtype):
-        return 'DATETIME'
-    else:
-        return 'VARCHAR(255)'
-
-def is_date_column(series):
-    date_patterns = [
-        re.compile(r'^\d{4}-\d{2}-\d{2}$'),  # YYYY-MM-DD
-        re.compile(r'^\d{4}/\d{2}/\d{2}$'),  # YYYY/MM/DD
-        re.compile(r'^\d{2}/\d{2}/\d{4}$'),  # MM/DD/YYYY
-        re.compile(r'^\d{2}-\d{2}-\d{4}$'),  # MM-DD-YYYY
-        re.compile(r'^\d{2}/\d{2}/\d{2}$'),  # MM/DD/YY
-        re.compile(r'^\d{2}-\d{2}-\d{2}$'),  # MM-DD-YY
-        re.compile(r'^\d{2}/\d{2}/\d{2}$'),  # DD/MM/YY
-        re.compile(r'^\d{2}/\d{2}/\d{4}$'),  # DD/MM/YYYY
-        re.compile(r'^\d{2}-\d{2}-\d{4}$'),  # DD-MM-YYYY
-        re.compile(r'^\d{4}\d{2}\d{2}$'),    # YYYYMMDD
-        re.compile(r'^\d{2}\d{2}\d{4}$'),    # DDMMYYYY
-        re.compile(r'^\d{2}\d{2}\d{2}$'),    # DDMMYY
-    ]
-    
-    sample_values = series.dropna().astype(str).head(100)
-    if all(any(pattern.match(value) for pattern in date_patterns) for value in sample_values):
-        return True
-    return False
-
-def get_date_format(series):
-    known_formats = [
-        "%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y",
-        "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%d-%m-%y",
-        "%Y%m%d", "%d%m%Y", "%d%m%y"
-    ]
-    
-    date_format_counts = {}
-    
-    for value in series.dropna().astype(str):
-        for fmt in known_formats:
-            try:
-                pd.to_datetime(value, format=fmt, errors='raise')
-                date_format_counts[fmt] = date_format_counts.get(fmt, 0) + 1
-                break
-            except ValueError:
-                continue
-    
-    if date_format_counts:
-        return max(date_format_counts, key=date_format_counts.get)
-    return None
-
-def convert_to_datetime(series):
-    format_detected = get_date_format(series)
-    if format_detected:
-        return pd.to_datetime(series, format=format_detected, errors='coerce')
-    return pd.to_datetime(series, infer_datetime_format=True, errors='coerce')
-
-def has_mixed_types(series):
-    types = series.dropna().apply(lambda x: type(x)).unique()
-    return len(types) > 1
-
-def clean_data_for_mysql(data):
-    for col in data.columns:
-        if data[col].dtype == 'datetime64[ns]':
-            data[col] = data[col].apply(lambda x: x if pd.notnull(x) else None)
-        else:
-            data[col] = data[col].apply(lambda x: x if pd.notnull(x) else None)
-    return data
-
 @csrf_exempt
 def upload_file(request):
     print("req")
     if request.method == 'POST':
+        # Refuse bodies that cannot fit under the cap before reading any of them
+        content_length = request.META.get('CONTENT_LENGTH', '')
+        max_body = MAX_UPLOAD_BYTES + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0) if MAX_UPLOAD_BYTES else None
+        if max_body and content_length.isdigit() and int(content_length) > max_body:
+            return JsonResponse({'error': f'Uploaded file is larger than {MAX_UPLOAD_BYTES} bytes'}, status=413)
+
+        # The file is streamed to disk and checked while the body is parsed, on first access to POST
+        upload_handler = CSVUploadHandler(request, accept_name=allowed_file)
+        request.upload_handlers.insert(0, upload_handler)
         host = request.POST.get('host')
+        if upload_handler.error:
+            data, status = upload_handler.error
+            return JsonResponse(data, status=status)
+
         user = request.POST.get('user')
         password = request.POST.get('password')
         database = request.POST.get('database')
         port=request.POST.get("port")
         DataBaseType=request.POST.get("DataBaseType")
-
-        if not all([host, user, password, database]):
+        insert_method = request.POST.get('insert_method') or INSERT_METHOD
+        mode = request.POST.get('mode') or UPLOAD_MODE
+        load_mode = request.POST.get('load_mode') or LOAD_MODE
+        key_column = request.POST.get('key_column') or None
+        atomic = request.POST.get('atomic')
+        atomic = atomic.lower() in ('1', 'true', 'yes') if atomic else ATOMIC_REPLACE
+        fast_load = request.POST.get('fast_load')
+        fast_load = fast_load.lower() in ('1', 'true', 'yes') if fast_load else FAST_LOAD
+        index_columns = [col.strip() for col in request.POST.get('index_columns', '').split(',') if col.strip()]
+        parser_engine = request.POST.get('parser_engine') or PARSER_ENGINE
+
+        try:
+            sink = get_sink(DataBaseType, insert_method)
+        except (ValueError, ImproperlyConfigured) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if not all(request.POST.get(field) for field in sink.required_fields):
             return JsonResponse({'error': 'Missing database connection details'}, status=400)
 
+        if port and not str(port).isdigit():
+            return JsonResponse({'error': 'Port must be a number'}, status=400)
+
+        if insert_method not in INSERT_METHODS:
+            return JsonResponse({'error': f"insert_method must be one of {', '.join(sorted(INSERT_METHODS))}"}, status=400)
+
+        if mode not in UPLOAD_MODES:
+            return JsonResponse({'error': f"mode must be one of {', '.join(sorted(UPLOAD_MODES))}"}, status=400)
+
+        if load_mode not in LOAD_MODES:
+            return JsonResponse({'error': f"load_mode must be one of {', '.join(sorted(LOAD_MODES))}"}, status=400)
+
+        if load_mode in KEYED_LOAD_MODES and not key_column:
+            return JsonResponse({'error': f"key_column is required for load_mode '{load_mode}'"}, status=400)
+
+        if parser_engine not in PARSER_ENGINES:
+            return JsonResponse({'error': f"parser_engine must be one of {', '.join(sorted(PARSER_ENGINES))}"}, status=400)
+
+        if parser_engine == 'pyarrow' and pa is None:
+            return JsonResponse({'error': "The 'pyarrow' parser engine requires the pyarrow package"}, status=400)
+
         if 'file' not in request.FILES or 'table_name' not in request.POST:
             return JsonResponse({'error': 'No file or table name provided'}, status=400)
 
@@ -128,85 +112,41 @@ def upload_file(request):
                 # Sanitize the filename to prevent path traversal
                 sanitized_filename = sanitize_filename(file.name)
 
-                # Save the file to the desired location
-                filename = default_storage.save(os.path.join(UPLOADS_PATH, sanitized_filename), file)
-                
-                # Construct the correct file path
-                filepath = os.path.join(settings.MEDIA_ROOT, filename)
-                
-                data = pd.read_csv(filepath, low_memory=False)
-                if data.empty:
-                    return JsonResponse({'error': 'Uploaded file is empty'}, status=400)
+                # Save the file under its content hash; identical uploads share one file
+                if isinstance(file, StoredUpload):
+                    digest, filepath = file.digest, file.filepath
+                else:
+                    digest, filepath = save_upload(file)
             except SuspiciousFileOperation as e:
                 return JsonResponse({'error': str(e)}, status=400)
-            except pd.errors.ParserError as e:
-                return JsonResponse({'error': 'Error parsing CSV file', 'message': str(e)}, status=500)
             except Exception as e:
                 return JsonResponse({'error': 'Error reading file', 'message': str(e)}, status=500)
 
-            try:
-                # Drop rows that are completely empty
-                data.dropna(how='all', inplace=True)
-
-                # Data processing
-                for col in data.columns:
-                    if is_date_column(data[col]):
-                        data[col] = convert_to_datetime(data[col])
-
-                for col in data.columns:
-                    if not is_date_column(data[col]):
-                        if has_mixed_types(data[col]):
-                            data[col] = data[col].astype(str)
-                        elif pd.api.types.is_integer_dtype(data[col]):
-                            data[col] = pd.to_numeric(data[col], downcast='integer')
-                        elif pd.api.types.is_float_dtype(data[col]):
-                            data[col] = pd.to_numeric(data[col], downcast='float')
-                        elif pd.api.types.is_string_dtype(data[col]):
-                            data[col] = data[col].astype('string')
-
-                # Clean the data for MySQL compatibility
-                data = clean_data_for_mysql(data)
-
-                # Collect column names and their data types
-                column_details = {col: map_dtype_to_mysql(data[col].dtype) for col in data.columns}
+            connection_details = {'host': host, 'port': int(port) if port else None, 'user': user, 'password': password, 'database': database}
+            load_options = {
+                'load_mode': load_mode, 'key_column': key_column, 'atomic': atomic,
+                'index_columns': index_columns, 'fast_load': fast_load, 'parser_engine': parser_engine,
+            }
 
-            except Exception as e:
-                return JsonResponse({'error': 'Error processing data', 'message': str(e)}, status=500)
+            if mode == 'job':
+                job = submit_upload_job(
+                    filepath, sanitized_filename, table_name, connection_details, insert_method,
+                    sink.database_type, digest, **load_options
+                )
+                return JsonResponse({
+                    'message': 'File uploaded and queued for loading',
+                    'job_id': str(job.id),
+                    'status_url': reverse('upload_status', args=[job.id]),
+                    'table_name': table_name,
+                }, status=202)
 
             try:
-                # Establish database connection
-                connection = pymysql.connect(
-                    host=host,
-                    user=user,
-                    password=password,
-                    database=database,
-                    cursorclass=pymysql.cursors.DictCursor
+                column_details, timings = ingest_csv(
+                    filepath, table_name, connection_details, insert_method,
+                    database_type=sink.database_type, digest=digest, **load_options
                 )
-                
-                with connection.cursor() as cursor:
-                    # Drop the table if it exists
-                    cursor.execute(f"DROP TABLE IF EXISTS `{table_name}`")
-                    
-                    # Create the table
-                    columns = ', '.join(f"`{col}` {map_dtype_to_mysql(data[col].dtype)}" for col in data.columns)
-                    create_table_query = f"CREATE TABLE `{table_name}` ({columns})"
-                    cursor.execute(create_table_query)
-                    
-                    # Insert data in chunks
-                    chunk_size = 1000
-                    for start in range(0, len(data), chunk_size):
-                        chunk = data.iloc[start:start + chunk_size]
-                        values = ', '.join(str(tuple(x)) for x in chunk.values)
-                        values = values.replace('NaT', 'NULL').replace('nan', 'NULL')  # Handle NaT and nan values
-                        insert_query = f"INSERT INTO `{table_name}` VALUES {values}"
-                        cursor.execute(insert_query)
-                        
-                connection.commit()
-                connection.close()
-            except pymysql.MySQLError as e:
-                return JsonResponse({'error': 'Database error', 'message': str(e)}, status=500)
-            except Exception as e:
-                return JsonResponse({'error': 'Error inserting data into database', 'message': str(e)}, status=500)
+            except IngestError as e:
+                return JsonResponse(e.as_dict(), status=e.status)
 
             # Include connection details (excluding password) and column names with their data types in the response
             response_data = {
@@ -220,14 +160,25 @@ def upload_file(request):
                     "DataBaseType":DataBaseType
                 },
                 'table_name': table_name,
-                'columns': column_details
+                'load_mode': load_mode,
+                'columns': column_details,
+                'timings': timings
             }
             return JsonResponse(response_data, status=201)
         else:
-            return JsonResponse({'error': 'Allowed file types are csv'}, status=400)
+            return JsonResponse({'error': UPLOAD_TYPES_ERROR}, status=400)
 
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+def upload_status(request, job_id):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        job = UploadJob.objects.get(pk=job_id)
+    except UploadJob.DoesNotExist:
+        return JsonResponse({'error': 'Upload job not found'}, status=404)
+    return JsonResponse(job.as_dict())
+
 
 
 
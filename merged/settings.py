@@ -128,3 +128,110 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# CSV upload ingestion
+# https://pandas.pydata.org/docs/user_guide/io.html#iterating-through-files-chunk-by-chunk
+
+CSVUPLOAD_CHUNK_ROWS = 50000
+
+CSVUPLOAD_SAMPLE_ROWS = 10000
+
+CSVUPLOAD_INSERT_BATCH_ROWS = 5000
+
+# 'insert' (parameterized batches) or 'load_data' (LOAD DATA LOCAL INFILE, needs local_infile on the server)
+CSVUPLOAD_INSERT_METHOD = 'insert'
+
+# 'sync' loads inside the request, 'job' hands the load to a worker pool and returns a job id
+CSVUPLOAD_UPLOAD_MODE = 'sync'
+
+CSVUPLOAD_JOB_WORKERS = 4
+
+# Processes used to classify and convert column batches of wide files; 1 disables the pool
+CSVUPLOAD_INFERENCE_WORKERS = 1
+
+# Values scanned per column when looking for mixed types; None scans the whole sample
+CSVUPLOAD_MIXED_TYPE_SAMPLE_VALUES = None
+
+# Pooled connections to upload targets, per (host, port, user, database)
+CSVUPLOAD_POOL_MAX_SIZE = 4
+
+CSVUPLOAD_POOL_IDLE_TIMEOUT = 300
+
+# DataBaseType used when an upload does not name one: 'mysql', 'postgresql' or 'sqlite'
+CSVUPLOAD_DEFAULT_DATABASE_TYPE = 'mysql'
+
+# SQLite upload targets are files in this directory
+CSVUPLOAD_SQLITE_ROOT = BASE_DIR / 'sqlite'
+
+# Keep the typed result of every upload next to it so identical re-uploads skip parsing
+CSVUPLOAD_TYPED_CACHE = True
+
+# Compression of the Arrow IPC staging files: 'zstd', 'lz4' or None (memory-mapped with zero copy)
+CSVUPLOAD_STAGING_COMPRESSION = 'zstd'
+
+# 'replace', 'append', 'upsert' or 'diff'; upsert and diff need a key_column and only send changed rows
+CSVUPLOAD_LOAD_MODE = 'replace'
+
+# Load replacements into <table>__staging and rename it over the table once complete
+CSVUPLOAD_ATOMIC_REPLACE = False
+
+# Build indexes after loading and, on MySQL, relax unique/foreign key checks and send larger INSERTs
+CSVUPLOAD_FAST_LOAD = False
+
+CSVUPLOAD_FAST_LOAD_STATEMENT_BYTES = 16 * 1024 * 1024
+
+# CSV parser: 'pandas', or 'pyarrow' for Arrow's multithreaded reader; uploads may pick one with parser_engine
+CSVUPLOAD_PARSER_ENGINE = 'pandas'
+
+# MySQL column planning from statistics over the staged upload
+CSVUPLOAD_ENUM_MAX_VALUES = 16
+
+CSVUPLOAD_VARCHAR_MAX_LENGTH = 1024
+
+CSVUPLOAD_DECIMAL_MAX_SCALE = 10
+
+# Characters of TEXT and long VARCHAR columns a MySQL index covers
+CSVUPLOAD_MYSQL_INDEX_PREFIX_LENGTH = 255
+
+# Text columns with few distinct values in the sample are held as pandas Categoricals
+CSVUPLOAD_CATEGORY_MAX_VALUES = 256
+
+CSVUPLOAD_CATEGORY_MAX_RATIO = 0.5
+
+# Uploads are streamed to disk and refused once larger than this (None for no limit)
+CSVUPLOAD_MAX_UPLOAD_BYTES = 1024 ** 3
+
+# Leading bytes of an upload checked for a header row and comma delimiter before the rest is read
+CSVUPLOAD_VALIDATE_BYTES = 64 * 1024
+
+# vizard keeps datasource metadata documents in process, invalidated by MongoDB change streams
+VIZARD_METADATA_CACHE_SIZE = 256
+
+VIZARD_METADATA_CACHE_TTL = 300
+
+VIZARD_METADATA_CHANGE_STREAMS = True
+
+# Without change streams, cached documents are revalidated against this field after a few seconds
+VIZARD_METADATA_VERSION_FIELD = 'updatedAt'
+
+VIZARD_METADATA_REVALIDATE_AFTER = 5
+
+# vizard answers identical prompts from a memory tier and an on-disk tier; None disables a tier
+VIZARD_RESPONSE_CACHE_MEMORY_BYTES = 16 * 1024 * 1024
+
+VIZARD_RESPONSE_CACHE_DISK_BYTES = 256 * 1024 * 1024
+
+VIZARD_RESPONSE_CACHE_PATH = BASE_DIR / 'vizard_cache'
+
+# Seconds an answer is reused; 0 disables the response cache
+VIZARD_RESPONSE_CACHE_TTL = 24 * 60 * 60
+
+# Ollama server and model vizard asks; point the URL at `manage.py stub_ollama` to load test
+VIZARD_OLLAMA_BASE_URL = 'http://122.176.146.28:11434'
+
+VIZARD_OLLAMA_MODEL = 'test09'
+
+# Prompts to the model are kept within this many tokens by listing fewer unique values (None for no limit)
+VIZARD_PROMPT_TOKEN_BUDGET = 4000
+
+VIZARD_PROMPT_CHARS_PER_TOKEN = 4
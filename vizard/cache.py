@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Metadata documents kept per collection, least recently used dropped first
+METADATA_CACHE_SIZE = getattr(settings, 'VIZARD_METADATA_CACHE_SIZE', 256)
+
+# Seconds a cached document is served before it is fetched again
+METADATA_CACHE_TTL = getattr(settings, 'VIZARD_METADATA_CACHE_TTL', 300)
+
+# Invalidate cached documents from a change stream on each collection. Change streams need
+# a replica set; where they are not available the cache falls back to version checks.
+METADATA_CHANGE_STREAMS = getattr(settings, 'VIZARD_METADATA_CHANGE_STREAMS', True)
+
+# Field bumped on every write (Mongoose keeps `updatedAt`); without change streams, a cached
+# document older than METADATA_REVALIDATE_AFTER seconds is only served again once a query
+# for its id and cached version still matches
+METADATA_VERSION_FIELD = getattr(settings, 'VIZARD_METADATA_VERSION_FIELD', 'updatedAt')
+
+METADATA_REVALIDATE_AFTER = getattr(settings, 'VIZARD_METADATA_REVALIDATE_AFTER', 5)
+
+_DEFAULT = object()
+
+# Size-bounded LRU/TTL cache of one collection's documents by _id, holding only `projection`
+class DocumentCache:
+    def __init__(self, collection, projection, max_entries=None, ttl=None, change_streams=None,
+                 version_field=None, revalidate_after=None, async_collection=None):
+        self.collection = collection
+        self.async_collection = async_collection
+        self.projection = dict(projection)
+        self.max_entries = max_entries or METADATA_CACHE_SIZE
+        self.ttl = METADATA_CACHE_TTL if ttl is None else ttl
+        self.change_streams = METADATA_CHANGE_STREAMS if change_streams is None else change_streams
+        self.version_field = version_field or METADATA_VERSION_FIELD
+        self.revalidate_after = METADATA_REVALIDATE_AFTER if revalidate_after is None else revalidate_after
+        if self.version_field:
+            self.projection[self.version_field] = 1
+        self.hits = self.misses = 0
+        self.watching = False
+        self._entries = OrderedDict()
+        # Bumped by every invalidation, so a fetch racing with a change is not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    # The projected document, or None when there is no such document
+    def get(self, document_id):
+        entry, now = self._cached(document_id)
+        if entry is not None and self._stale(entry, now):
+            query = self._version_query(document_id, entry)
+            entry = self._checked(entry, now, query and self.collection.find_one(query, {'_id': 1}))
+        if entry is not None:
+            self.hits += 1
+            return entry['document']
+
+        self.misses += 1
+        generation = self._generation
+        document = self.collection.find_one({'_id': document_id}, self.projection)
+        self._store(document_id, document, now, generation)
+        return document
+
+    # get() for async views, querying through `async_collection` (a pymongo AsyncMongoClient
+    # or motor collection); without one, the blocking lookup runs in a worker thread
+    async def aget(self, document_id):
+        if self.async_collection is None:
+            return await sync_to_async(self.get, thread_sensitive=False)(document_id)
+        entry, now = self._cached(document_id)
+        if entry is not None and self._stale(entry, now):
+            query = self._version_query(document_id, entry)
+            entry = self._checked(entry, now, query and await self.async_collection.find_one(query, {'_id': 1}))
+        if entry is not None:
+            self.hits += 1
+            return entry['document']
+
+        self.misses += 1
+        generation = self._generation
+        document = await self.async_collection.find_one({'_id': document_id}, self.projection)
+        self._store(document_id, document, now, generation)
+        return document
+
+    def _cached(self, document_id):
+        self._ensure_watcher()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is not None and now - entry['loaded'] < self.ttl:
+                self._entries.move_to_end(document_id)
+            else:
+                entry = None
+        return entry, now
+
+    def _stale(self, entry, now):
+        return not self.watching and now - entry['checked'] >= self.revalidate_after
+
+    # Matches the document only while it still has the cached version
+    def _version_query(self, document_id, entry):
+        document = entry['document']
+        if document is None or not self.version_field:
+            return None
+        return {'_id': document_id, self.version_field: document.get(self.version_field)}
+
+    def _checked(self, entry, now, match):
+        if not match:
+            return None
+        entry['checked'] = now
+        return entry
+
+    def _store(self, document_id, document, now, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[document_id] = {'document': document, 'loaded': now, 'checked': now}
+            self._entries.move_to_end(document_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, document_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(document_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'watching': self.watching}
+
+    def _ensure_watcher(self):
+        if not self.change_streams or self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch, daemon=True, name=f'vizard-cache-{self.collection.name}')
+            self._watcher.start()
+
+    # Drop every document a write touches, inserts included since a missing id is cached as
+    # None. Entries cached before the stream opened are dropped too, as they may predate a
+    # change. If the stream cannot be opened, or breaks, the cache is emptied and falls back
+    # to version checks, since changes may have been missed.
+    def _watch(self):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        try:
+            with self.collection.watch(pipeline) as stream:
+                self.watching = True
+                self.clear()
+                for change in stream:
+                    self.invalidate(change['documentKey']['_id'])
+        except Exception:
+            pass
+        finally:
+            self.watching = False
+            self.clear()
+
+# Answers to identical prompts, kept in memory and on disk; None for either size disables that tier
+RESPONSE_CACHE_MEMORY_BYTES = getattr(settings, 'VIZARD_RESPONSE_CACHE_MEMORY_BYTES', 16 * 1024 * 1024)
+
+RESPONSE_CACHE_DISK_BYTES = getattr(settings, 'VIZARD_RESPONSE_CACHE_DISK_BYTES', 256 * 1024 * 1024)
+
+RESPONSE_CACHE_PATH = getattr(settings, 'VIZARD_RESPONSE_CACHE_PATH', os.path.join(settings.BASE_DIR, 'vizard_cache'))
+
+# Seconds an answer is reused; 0 disables the cache
+RESPONSE_CACHE_TTL = getattr(settings, 'VIZARD_RESPONSE_CACHE_TTL', 24 * 60 * 60)
+
+# The same prompt sent to the same model with the same generation parameters
+def response_cache_key(prompt, model, params=None):
+    material = json.dumps({'prompt': prompt, 'model': model, 'params': params or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+# Two-tier cache of LLM responses by response_cache_key. The memory tier is an LRU bounded
+# in bytes; the disk tier keeps one JSON file per key, shared by every process, and drops the
+# least recently used files once it outgrows its size.
+class ResponseCache:
+    def __init__(self, path=None, ttl=None, memory_bytes=_DEFAULT, disk_bytes=_DEFAULT):
+        self.path = path or RESPONSE_CACHE_PATH
+        self.ttl = RESPONSE_CACHE_TTL if ttl is None else ttl
+        self.memory_bytes = RESPONSE_CACHE_MEMORY_BYTES if memory_bytes is _DEFAULT else memory_bytes
+        self.disk_bytes = RESPONSE_CACHE_DISK_BYTES if disk_bytes is _DEFAULT else disk_bytes
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+        self._entries = OrderedDict()
+        self._entries_bytes = 0
+        self._disk_used = None
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.json')
+
+    def get(self, key):
+        if not self.ttl:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry['created'] < self.ttl:
+                self._entries.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return entry['response']
+
+        entry = self._read_file(key, now) if self.disk_bytes else None
+        with self._lock:
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+        self._remember(key, entry)
+        return entry['response']
+
+    def set(self, key, response):
+        if not self.ttl:
+            return
+        entry = {'created': time.time(), 'response': response}
+        self._remember(key, entry)
+        if self.disk_bytes:
+            self._write_file(key, entry)
+
+    def _remember(self, key, entry):
+        if not self.memory_bytes:
+            return
+        size = len(entry['response'].encode('utf-8'))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._entries_bytes -= old['size']
+            self._entries[key] = dict(entry, size=size)
+            self._entries_bytes += size
+            while self._entries_bytes > self.memory_bytes and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self._entries_bytes -= old['size']
+                self.counters['memory_evictions'] += 1
+
+    def _read_file(self, key, now):
+        try:
+            with open(self._file(key), encoding='utf-8') as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if now - entry['created'] >= self.ttl:
+            return None
+        try:
+            # The modification time orders files for eviction
+            os.utime(self._file(key))
+        except OSError:
+            pass
+        return entry
+
+    def _write_file(self, key, entry):
+        os.makedirs(self.path, exist_ok=True)
+        fd, part_path = tempfile.mkstemp(dir=self.path, suffix='.part')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                json.dump(entry, fh)
+            size = os.path.getsize(part_path)
+            os.replace(part_path, self._file(key))
+        except BaseException:
+            os.remove(part_path)
+            raise
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = self._scan()[1]
+            else:
+                self._disk_used += size
+            if self._disk_used > self.disk_bytes:
+                self._evict_files()
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files, sum(size for _, size, _ in files)
+
+    # Other processes write here too, so the directory itself is the source of truth
+    def _evict_files(self):
+        files, used = self._scan()
+        for _, size, path in sorted(files):
+            if used <= self.disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            used -= size
+            self.counters['disk_evictions'] += 1
+        self._disk_used = used
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._entries_bytes = 0
+            self._disk_used = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, memory_entries=len(self._entries), memory_bytes=self._entries_bytes)
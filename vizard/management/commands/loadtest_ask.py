@@ -0,0 +1,79 @@
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+
+# Fire the same question, made unique per request so the response cache never answers it,
+# at one or more api_ask endpoints and report throughput and latency for each.
+# To compare the sync and async views, run `manage.py stub_ollama`, set VIZARD_OLLAMA_BASE_URL
+# to it and serve merged.asgi (e.g. `uvicorn merged.asgi:application`), then:
+#   manage.py loadtest_ask --url http://127.0.0.1:8000/vizard/api/ask/ \
+#       --url http://127.0.0.1:8000/vizard/api/ask/async/ --column-document-id ... --unique-values-document-id ...
+class Command(BaseCommand):
+    help = 'Load test api_ask endpoints with concurrent questions and report throughput and latency as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True, help='Endpoint to test; repeat to compare')
+        parser.add_argument('--column-document-id', required=True)
+        parser.add_argument('--unique-values-document-id', required=True)
+        parser.add_argument('--query', default='Which columns hold dates?')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--timeout', type=float, default=300)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1')
+        report = {
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'results': [self.run(url, options) for url in options['url']],
+        }
+        text = json.dumps(report, indent=2) + '\n'
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write(text)
+        else:
+            self.stdout.write(text, ending='')
+
+    def ask(self, url, options, number):
+        body = json.dumps({
+            'query': f"{options['query']} (#{number} {time.time_ns()})",
+            'column_document_id': options['column_document_id'],
+            'unique_values_document_id': options['unique_values_document_id'],
+        }).encode('utf-8')
+        request = urllib.request.Request(url, body, {'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                response.read()
+                ok = response.status == 200
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return ok, time.perf_counter() - started
+
+    def run(self, url, options):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            outcomes = list(pool.map(lambda number: self.ask(url, options, number), range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(seconds for ok, seconds in outcomes if ok)
+        result = {
+            'url': url,
+            'ok': len(latencies),
+            'errors': len(outcomes) - len(latencies),
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(latencies) / elapsed, 2),
+        }
+        if latencies:
+            result.update({
+                'latency_p50': round(statistics.median(latencies), 3),
+                'latency_p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                'latency_max': round(latencies[-1], 3),
+            })
+        return result
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+from django.core.management.base import BaseCommand
+
+# A stand-in for the Ollama server: POST /api/generate answers any prompt with `tokens` tokens,
+# one every `delay` seconds, streamed as NDJSON like Ollama does. Point VIZARD_OLLAMA_BASE_URL
+# at it to load test api_ask without a model.
+class Command(BaseCommand):
+    help = 'Serve a fake Ollama /api/generate that streams slow tokens, for load testing api_ask'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=11500)
+        parser.add_argument('--tokens', type=int, default=20)
+        parser.add_argument('--delay', type=float, default=0.1, help='Seconds between tokens')
+
+    def handle(self, *args, **options):
+        self.tokens = options['tokens']
+        self.delay = options['delay']
+        self.stdout.write(f"Fake Ollama on http://{options['host']}:{options['port']} "
+                          f"({self.tokens} tokens, {self.delay}s apart)")
+        try:
+            asyncio.run(self.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if method == 'POST' and path.startswith('/api/generate'):
+                await self.generate(writer, json.loads(body or b'{}'))
+            elif path.startswith('/api/tags'):
+                await self.respond(writer, b'{"models": []}')
+            else:
+                await self.respond(writer, b'{"error": "not found"}', '404 Not Found')
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, body, status='200 OK'):
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def generate(self, writer, request):
+        model = request.get('model', 'stub')
+        tokens = [f'token{i} ' for i in range(self.tokens)]
+        if not request.get('stream', True):
+            await asyncio.sleep(self.delay * self.tokens)
+            await self.respond(writer, json.dumps({'model': model, 'response': ''.join(tokens), 'done': True}).encode())
+            return
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                     b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+        for token in tokens + [None]:
+            await asyncio.sleep(self.delay if token is not None else 0)
+            line = json.dumps({
+                'model': model,
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'response': token or '',
+                'done': token is None,
+            }).encode() + b'\n'
+            writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
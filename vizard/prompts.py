@@ -0,0 +1,86 @@
+import re
+from django.conf import settings
+
+# Most tokens a prompt to the model may take; the unique values listed are cut to fit. None disables it.
+PROMPT_TOKEN_BUDGET = getattr(settings, 'VIZARD_PROMPT_TOKEN_BUDGET', 4000)
+
+# Token estimate without a tokenizer: about four characters per token for English text
+PROMPT_CHARS_PER_TOKEN = getattr(settings, 'VIZARD_PROMPT_CHARS_PER_TOKEN', 4)
+
+_WORD = re.compile(r'\w+')
+
+# Question words too common to say anything about which values matter
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'by', 'do', 'for', 'from', 'how', 'in', 'is', 'it', 'many', 'much',
+    'of', 'on', 'or', 'show', 'the', 'to', 'was', 'were', 'what', 'which', 'who', 'with',
+}
+
+def estimate_tokens(text):
+    return -(-len(text) // PROMPT_CHARS_PER_TOKEN)
+
+def _tokens(text):
+    return _WORD.findall(text.casefold())
+
+def _words(text):
+    return {word for word in _tokens(text) if word not in STOPWORDS}
+
+# Whether `part` occurs as a run of whole tokens in `tokens`, so "customer 4" is not found
+# in "customer 49999"
+def _contains_tokens(tokens, part):
+    size = len(part)
+    return any(tokens[start:start + size] == part for start in range(len(tokens) - size + 1))
+
+# How strongly the question points at `value`: the words they share, and more when the
+# question names the value in full
+def relevance(value, question_words, question_tokens):
+    words = _words(value)
+    score = len(words & question_words)
+    if score and _contains_tokens(question_tokens, _tokens(value)):
+        score += len(words) + 1
+    return score
+
+# (score, value) pairs of a column, most relevant to the question first; ties keep the stored
+# order, which is the order the values were collected in
+def _scored(values, question):
+    question_words = _words(question)
+    if not question_words:
+        return [(0, value) for value in values]
+    question_tokens = _tokens(question)
+    scored = [(relevance(value, question_words, question_tokens), index, value) for index, value in enumerate(values)]
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [(score, value) for score, _, value in scored]
+
+def rank_values(values, question=''):
+    return [value for _, value in _scored(values, question)]
+
+def summarize_values(shown, hidden):
+    return ', '.join(shown + ([f'... and {hidden:,} more'] if hidden else []))
+
+# Pick the unique values to list per column within `char_budget` characters, returning
+# {column: (shown values, number left out)}. Every column gets its next value in turn, so a
+# column with 50k values cannot crowd out the rest; within a column, values the question
+# mentions go first.
+def select_values(values_by_column, question='', char_budget=None):
+    if char_budget is None:
+        return {col: (list(values), 0) for col, values in values_by_column.items()}
+
+    scored = {col: _scored(values, question) for col, values in values_by_column.items()}
+    # Room for the "... and N more" of every column that may be cut
+    char_budget -= sum(len(summarize_values([], len(values))) + 2 for values in scored.values() if values)
+    candidates = sorted(
+        (rank, position, col, value)
+        for position, (col, values) in enumerate(scored.items()) for rank, (_, value) in enumerate(values)
+    )
+
+    chosen = {col: set() for col in scored}
+    for rank, _, col, value in candidates:
+        cost = len(value) + 2
+        if cost <= char_budget:
+            chosen[col].add(rank)
+            char_budget -= cost
+
+    selected = {}
+    for col, values in scored.items():
+        shown = [value for rank, (_, value) in enumerate(values) if rank in chosen[col]]
+        selected[col] = (shown, len(values) - len(shown))
+    return selected
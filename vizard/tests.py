@@ -1,3 +1,360 @@
-from django.test import TestCase
+import json
+import os
+import queue
+import shutil
+import tempfile
+import time
+from unittest import mock
+from bson import ObjectId
+from django.test import SimpleTestCase
+from django.urls import reverse
+from . import views
+from .cache import DocumentCache, ResponseCache
+from .prompts import rank_values, select_values
 
-# Create your tests here.
+# Stands in for a pymongo collection: find_one over a dict of documents, and change streams
+# fed from `changes` that only pass the operation types their $match lists
+class FakeCollection:
+    name = 'fake'
+
+    def __init__(self, documents=()):
+        self.documents = {document['_id']: dict(document) for document in documents}
+        self.queries = 0
+        self.streams = []
+        self.on_find = None
+
+    def find_one(self, query, projection=None):
+        self.queries += 1
+        if self.on_find:
+            self.on_find()
+        document = self.documents.get(query['_id'])
+        if document is None or any(document.get(field) != value for field, value in query.items()):
+            return None
+        return {field: value for field, value in document.items() if field == '_id' or field in (projection or document)}
+
+    def watch(self, pipeline):
+        stream = FakeStream(pipeline[0]['$match']['operationType']['$in'])
+        self.streams.append(stream)
+        return stream
+
+    def write(self, operation, document_id, **fields):
+        if operation == 'delete':
+            self.documents.pop(document_id, None)
+        else:
+            self.documents[document_id] = dict(self.documents.get(document_id, {}), _id=document_id, **fields)
+        for stream in self.streams:
+            if operation in stream.operations:
+                stream.changes.put({'operationType': operation, 'documentKey': {'_id': document_id}})
+
+class FakeStream:
+    def __init__(self, operations):
+        self.operations = operations
+        self.changes = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        while True:
+            change = self.changes.get()
+            if isinstance(change, Exception):
+                raise change
+            yield change
+
+# FakeCollection behind pymongo's async API, as DocumentCache.aget queries it
+class FakeAsyncCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.queries = 0
+
+    async def find_one(self, query, projection=None):
+        self.queries += 1
+        return self.collection.find_one(query, projection)
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for the change stream')
+        time.sleep(0.005)
+
+# Wait until the cache's change stream is open and has emptied the cache it started with
+def wait_for_stream(cache):
+    wait_for(lambda: cache.watching and cache._generation)
+
+class DocumentCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.collection = FakeCollection([{'_id': 1, 'name': 'orders', 'updatedAt': 1}])
+        self.addCleanup(self.close_streams)
+
+    # Let the watcher threads finish
+    def close_streams(self):
+        for stream in self.collection.streams:
+            stream.changes.put(RuntimeError('closed'))
+
+    def cache(self, **options):
+        options = dict({'change_streams': False, 'revalidate_after': 60}, **options)
+        return DocumentCache(self.collection, {'name': 1}, version_field='updatedAt', **options)
+
+    def test_documents_are_served_from_memory(self):
+        cache = self.cache()
+        self.assertEqual(cache.get(1)['name'], 'orders')
+        self.assertEqual(cache.get(1)['name'], 'orders')
+        self.assertEqual(self.collection.queries, 1)
+        self.assertEqual(cache.stats(), {'entries': 1, 'hits': 1, 'misses': 1, 'watching': False})
+
+    def test_version_check_refetches_changed_documents(self):
+        cache = self.cache(revalidate_after=0)
+        cache.get(1)
+        self.assertEqual(cache.get(1)['name'], 'orders')
+        self.collection.write('update', 1, name='sales', updatedAt=2)
+        self.assertEqual(cache.get(1)['name'], 'sales')
+
+    def test_least_recently_used_entries_are_dropped(self):
+        self.collection.write('insert', 2, name='sales', updatedAt=1)
+        cache = self.cache(max_entries=1)
+        cache.get(1)
+        cache.get(2)
+        cache.get(1)
+        self.assertEqual(self.collection.queries, 3)
+
+    def test_fetch_racing_an_invalidation_is_not_cached(self):
+        cache = self.cache()
+        self.collection.on_find = lambda: cache.invalidate(1)
+        cache.get(1)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_change_stream_invalidates_updates_and_inserts(self):
+        cache = self.cache(change_streams=True)
+        self.assertIsNone(cache.get(2))
+        wait_for_stream(cache)
+        cache.get(1)
+        self.assertIsNone(cache.get(2))
+
+        self.collection.write('insert', 2, name='sales', updatedAt=1)
+        wait_for(lambda: 2 not in cache._entries)
+        self.assertEqual(cache.get(2)['name'], 'sales')
+
+        self.collection.write('update', 1, name='returns', updatedAt=2)
+        wait_for(lambda: 1 not in cache._entries)
+        self.assertEqual(cache.get(1)['name'], 'returns')
+
+    def test_broken_change_stream_falls_back_to_version_checks(self):
+        cache = self.cache(change_streams=True)
+        cache.get(1)
+        wait_for_stream(cache)
+        cache.get(1)
+        self.collection.streams[0].changes.put(RuntimeError('stream closed'))
+        wait_for(lambda: not cache.watching)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, 'responses')
+
+    def cache(self, **options):
+        options = dict({'ttl': 60, 'memory_bytes': 1024, 'disk_bytes': 1024 * 1024}, **options)
+        return ResponseCache(self.path, **options)
+
+    def test_responses_expire_after_the_ttl(self):
+        with mock.patch('vizard.cache.time') as clock:
+            clock.time.return_value = 1000
+            cache = self.cache()
+            cache.set('k', 'answer')
+            clock.time.return_value = 1059
+            self.assertEqual(cache.get('k'), 'answer')
+            clock.time.return_value = 1060
+            self.assertIsNone(cache.get('k'))
+            self.assertIsNone(self.cache().get('k'))
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_disk_tier_is_shared_between_instances(self):
+        self.cache().set('k', 'answer')
+        cache = self.cache()
+        self.assertEqual(cache.get('k'), 'answer')
+        self.assertEqual(cache.get('k'), 'answer')
+        self.assertIsNone(cache.get('other'))
+        self.assertEqual(cache.stats(), {
+            'memory_hits': 1, 'disk_hits': 1, 'misses': 1, 'memory_evictions': 0, 'disk_evictions': 0,
+            'memory_entries': 1, 'memory_bytes': len('answer'),
+        })
+
+    def test_least_recently_used_responses_leave_memory(self):
+        cache = self.cache(memory_bytes=250, disk_bytes=None)
+        cache.set('a', 'a' * 100)
+        cache.set('b', 'b' * 100)
+        cache.get('a')
+        cache.set('c', 'c' * 100)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'a' * 100)
+        self.assertEqual(cache.stats()['memory_evictions'], 1)
+        self.assertEqual(cache.stats()['memory_bytes'], 200)
+
+    def test_least_recently_read_files_are_evicted(self):
+        cache = self.cache()
+        cache.set('a', 'a' * 100)
+        size = os.path.getsize(os.path.join(self.path, 'a.json'))
+        cache = self.cache(memory_bytes=None, disk_bytes=int(size * 2.5))
+        cache.set('b', 'b' * 100)
+        os.utime(os.path.join(self.path, 'a.json'), (1, 1))
+        os.utime(os.path.join(self.path, 'b.json'), (2, 2))
+        # Reading a file marks it as recently used
+        self.assertEqual(cache.get('a'), 'a' * 100)
+        cache.set('c', 'c' * 100)
+        self.assertEqual(sorted(os.listdir(self.path)), ['a.json', 'c.json'])
+        self.assertEqual(cache.stats()['disk_evictions'], 1)
+
+# Stands in for the Ollama model: answers with `tokens`, streamed one at a time, and fails
+# with `error` after the first one when given
+class FakeLLM:
+    model = 'fake'
+    _identifying_params = {'model': 'fake'}
+
+    def __init__(self, tokens=('Sales ', 'by ', 'region'), error=None):
+        self.tokens = tokens
+        self.error = error
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        return ''.join(self.tokens)
+
+    async def ainvoke(self, prompt):
+        return self(prompt)
+
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        for index, token in enumerate(self.tokens):
+            if self.error and index:
+                raise self.error
+            yield token
+
+    async def astream(self, prompt):
+        for token in self.stream(prompt):
+            yield token
+
+# (event, data) pairs of a server-sent event stream; events without a name are 'message's
+def parse_events(body):
+    events = []
+    for block in body.split('\n\n')[:-1]:
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+def stream_body(response):
+    return b''.join(response.streaming_content).decode()
+
+async def astream_body(response):
+    return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+class AskTests(SimpleTestCase):
+    column_document_id = '64b000000000000000000001'
+    unique_values_document_id = '64b000000000000000000002'
+
+    def setUp(self):
+        self.llm = FakeLLM()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        columns = FakeCollection([{
+            '_id': ObjectId(self.column_document_id), 'ColumnDetails': [{'columnName': 'region', 'uuid': 'u-1'}],
+        }])
+        values = FakeCollection([{
+            '_id': ObjectId(self.unique_values_document_id), 'UniqueValues': {'region': ['North', 'South']},
+        }])
+        self.async_columns = FakeAsyncCollection(columns)
+        self.async_values = FakeAsyncCollection(values)
+        for name, value in [
+            ('ollama_instance', self.llm),
+            ('response_cache', ResponseCache(directory, ttl=60)),
+            ('column_details_cache', DocumentCache(
+                columns, {'ColumnDetails': 1}, change_streams=False, async_collection=self.async_columns)),
+            ('unique_values_cache', DocumentCache(
+                values, {'UniqueValues': 1}, change_streams=False, async_collection=self.async_values)),
+        ]:
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def payload(self, **fields):
+        return json.dumps(dict({
+            'query': 'Sales in the North',
+            'column_document_id': self.column_document_id,
+            'unique_values_document_id': self.unique_values_document_id,
+        }, **fields))
+
+    def test_stream_frames_tokens_as_server_sent_events(self):
+        response = views.stream_answer('prompt', 'key')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(stream_body(response), (
+            'data: {"token": "Sales "}\n\n'
+            'data: {"token": "by "}\n\n'
+            'data: {"token": "region"}\n\n'
+            'event: done\ndata: {"response": "Sales by region", "prompt_tokens": 2}\n\n'
+        ))
+
+    def test_streamed_answer_equals_the_plain_answer(self):
+        url = reverse('api_ask')
+        events = parse_events(stream_body(self.client.post(url, self.payload(stream=True), content_type='application/json')))
+        tokens = ''.join(data['token'] for event, data in events if event == 'message')
+        self.assertEqual(events[-1], ('done', {'response': tokens, 'prompt_tokens': events[-1][1]['prompt_tokens']}))
+
+        # Served from the response cache as a single token
+        cached = parse_events(stream_body(self.client.post(url, self.payload(stream=True), content_type='application/json')))
+        self.assertEqual(cached, [('message', {'token': tokens}), events[-1]])
+
+        views.response_cache.clear()
+        response = self.client.post(url, self.payload(), content_type='application/json')
+        self.assertEqual(response.json(), events[-1][1])
+        self.assertEqual(len(self.llm.prompts), 2)
+
+    def test_model_failure_ends_the_stream_with_an_error_event(self):
+        self.llm.error = RuntimeError('model went away')
+        events = parse_events(stream_body(views.stream_answer('prompt', 'key')))
+        self.assertEqual(events, [
+            ('message', {'token': 'Sales '}), ('error', {'response': 'Error from Ollama model: model went away'}),
+        ])
+        self.assertIsNone(views.response_cache.get('key'))
+
+    async def test_async_stream_matches_the_sync_stream(self):
+        expected = stream_body(views.stream_answer('prompt', 'sync'))
+        self.assertEqual(await astream_body(views.astream_answer('prompt', 'async')), expected)
+
+        self.llm.error = RuntimeError('model went away')
+        events = parse_events(await astream_body(views.astream_answer('prompt', 'failed')))
+        self.assertEqual(events[-1], ('error', {'response': 'Error from Ollama model: model went away'}))
+
+    async def test_async_view_reads_documents_through_aget(self):
+        url = reverse('api_ask_async')
+        response = await self.async_client.post(url, self.payload(), content_type='application/json')
+        answer = json.loads(response.content)
+        self.assertEqual(answer['response'], 'Sales by region')
+        self.assertIn('North', self.llm.prompts[0])
+        self.assertEqual((self.async_columns.queries, self.async_values.queries), (1, 1))
+
+        response = await self.async_client.post(url, self.payload(stream=True), content_type='application/json')
+        events = parse_events(await astream_body(response))
+        self.assertEqual(events, [('message', {'token': 'Sales by region'}), ('done', answer)])
+        # Both documents came from the cache
+        self.assertEqual((self.async_columns.queries, self.async_values.queries), (1, 1))
+
+class RelevanceTests(SimpleTestCase):
+    def test_full_value_bonus_needs_whole_words(self):
+        values = ['Customer 4', 'Customer North', 'Customer 49999']
+        self.assertEqual(
+            rank_values(values, 'Orders of Customer 49999 in the north'), ['Customer 49999', 'Customer North', 'Customer 4']
+        )
+        self.assertEqual(rank_values(values, 'Orders of customer 4'), ['Customer 4', 'Customer North', 'Customer 49999'])
+
+    def test_select_values_keeps_mentioned_values_within_budget(self):
+        values = {'customer': [f'Customer {i}' for i in range(1, 1000)], 'region': ['North', 'South']}
+        selected = select_values(values, 'Sales of Customer 500 in the South', char_budget=200)
+        self.assertEqual(selected['customer'][0][0], 'Customer 500')
+        self.assertEqual(selected['region'][0][0], 'South')
+        shown = sum(len(value) + 2 for column_values, _ in selected.values() for value in column_values)
+        self.assertLessEqual(shown, 200)
@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path('api/ask/', views.api_ask, name='api_ask'),  # Add the route for your API
+    path('api/ask/async/', views.api_ask_async, name='api_ask_async'),  # api_ask for ASGI servers
+    path('api/cache/', views.api_cache_stats, name='api_cache_stats'),  # Cache hit/miss counters
 ]
\ No newline at end of file